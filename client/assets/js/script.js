@@ -260,6 +260,17 @@ var showDevicePickerModal = function() {
     });
 }
 
+function decodePeaks(encoded) {
+    // Base64 encoded int8 (max, min) pairs, computed by the server when the asset was uploaded
+    var bytes = atob(encoded);
+    var peaks = new Array(bytes.length);
+    for (var i = 0; i < bytes.length; i++) {
+        var value = bytes.charCodeAt(i);
+        peaks[i] = (value > 127 ? value - 256 : value) / 128;
+    }
+    return peaks;
+}
+
 function loadWaveform(asset, play = true) {
     if (wavesurfer) {
         wavesurfer.destroy();
@@ -326,7 +337,12 @@ function loadWaveform(asset, play = true) {
             wavesurfer.play()
         };
     });
-    wavesurfer.load(asset.url);
+    if (asset.peaks) {
+        // Draw from precomputed peaks rather than decoding the whole file
+        wavesurfer.load(asset.url, decodePeaks(asset.peaks), 'auto', asset.length);
+    } else {
+        wavesurfer.load(asset.url);
+    }
     $('#track-title').text(': ' + asset.name);
     $('#track-time').text(' {0:00/' + prettyDuration(asset.length) + '}');
 }
@@ -1,19 +1,23 @@
 from collections import defaultdict
 import datetime
+import gzip
 import logging
 from json.decoder import JSONDecodeError
 import os
-import random
+import shutil
 import time
 
+from django.apps import apps
 from django.core.serializers import deserialize, serialize
 from django.db import transaction
 import requests
 
 from . import constants
+from .columnar import COLUMNAR_FORMAT, decode_tables
 from .constants import APIException
 from .config import Config
-from .models import get_latest_tomato_migration, Asset, LogEntry, Rotator, StopSet, StopSetRotator
+from .models import get_latest_tomato_migration, Asset, CatalogVersion, LogEntry, Rotator, StopSet, StopSetRotator
+from .selection import WeightedSelector
 
 logger = logging.getLogger('tomato')
 DEFAULT_HEADERS = {'User-Agent': constants.REQUEST_USER_AGENT}
@@ -23,12 +27,12 @@ class make_request:
     def __init__(self):
         self.conf = Config()
 
-    def __call__(self, method, endpoint, json_expected=True, **params):
+    def __call__(self, method, endpoint, json_expected=True, extra_headers=None, **params):
+        headers = dict(DEFAULT_HEADERS)
         if self.conf.auth_token:
-            headers = {'X-Auth-Token': self.conf.auth_token}
-            headers.update(DEFAULT_HEADERS)
-        else:
-            headers = DEFAULT_HEADERS
+            headers['X-Auth-Token'] = self.conf.auth_token
+        if extra_headers:
+            headers.update(extra_headers)
 
         url = f'{self.conf.protocol}://{self.conf.hostname}/{endpoint}'
         logger.info(f'Hitting [{method.upper()}] {url}')
@@ -44,7 +48,10 @@ class make_request:
             raise APIException(error)
 
         else:
-            if response.status_code == 200:
+            if response.status_code == 304:
+                # Not modified, only happens for conditional requests
+                return None
+            elif response.status_code == 200:
                 try:
                     return response.json() if json_expected else True
                 except JSONDecodeError:
@@ -69,7 +76,7 @@ class AuthAPI(APIBase):
     namespace = 'auth'
 
     def logout(self, remove_unused_assets=True):
-        self.conf.update(auth_token=None, last_sync=None)
+        self.conf.update(auth_token=None, catalog_version=None, last_sync=None)
 
         # TODO: When is the best time clean up assets? We shouldn't do it on sync
         # because old assets may be being streamed from in CEF window.
@@ -99,7 +106,8 @@ class AuthAPI(APIBase):
             else:
                 connected = True
                 logged_in = response['valid_token']
-                logger.info(f'Server version {response["version"]}')
+                logger.info(f'Server version {response["version"]}, catalog version {response["catalog_version"]} '
+                            f'(ours: {self.conf.catalog_version})')
 
                 if logged_in:
                     our_migration = get_latest_tomato_migration()
@@ -137,22 +145,37 @@ class ModelsAPI(APIBase):
     namespace = 'models'
 
     @staticmethod
-    def _download_asset_audio(media_url, asset):
+    def _download_asset_audio(media_url, asset, local_paths_by_hash):
         remote_filename = asset.audio.name
         local_filename = os.path.join(
             constants.MEDIA_DIR, remote_filename.replace('/', os.path.sep))
 
         if not os.path.exists(local_filename) or os.path.getsize(local_filename) != asset.audio_size:
+            os.makedirs(os.path.dirname(local_filename), exist_ok=True)
+
+            # We may already have identical audio under another name, in which case there's nothing to download
+            local_copy = local_paths_by_hash.get(asset.audio_hash) if asset.audio_hash else None
+            if local_copy and os.path.exists(local_copy) and os.path.getsize(local_copy) == asset.audio_size:
+                logger.info(f'sync: Linking asset {remote_filename} to identical audio at {local_copy}')
+                if os.path.exists(local_filename):
+                    os.remove(local_filename)
+                try:
+                    os.link(local_copy, local_filename)
+                except OSError:
+                    shutil.copyfile(local_copy, local_filename)
+                return 0
+
             remote_url = media_url + remote_filename
             logger.info(f'sync: Downloading asset: {remote_url}')
 
-            os.makedirs(os.path.dirname(local_filename), exist_ok=True)
             with requests.get(remote_url, stream=True, headers=DEFAULT_HEADERS) as response:
                 response.raise_for_status()
                 with open(local_filename, 'wb') as file:
                     for chunk in response.iter_content(chunk_size=8192):
                         if chunk:
                             file.write(chunk)
+            if asset.audio_hash:
+                local_paths_by_hash[asset.audio_hash] = local_filename
             return os.path.getsize(local_filename)
         else:
             return 0
@@ -179,7 +202,8 @@ class ModelsAPI(APIBase):
                 serialized = serialize('json', log_entries, use_natural_primary_keys=True,
                                        fields=('uuid', 'created', 'action', 'duration', 'description'))
 
-                if make_request('post', 'log', json_expected=False, data=serialized):
+                if make_request('post', 'log', json_expected=False, data=gzip.compress(serialized.encode('utf8')),
+                                extra_headers={'Content-Encoding': 'gzip', 'Content-Type': 'application/json'}):
                     logger.info(f'Pushed {len(log_entries)} log entries. Deleting them.')
                     LogEntry.objects.filter(id__in=[log_entry.id for log_entry in log_entries]).delete()
             else:
@@ -195,11 +219,12 @@ class ModelsAPI(APIBase):
 
         stopset = None
         stopsets = list(StopSet.objects.currently_enabled())
+        stopset_selector = WeightedSelector(stopsets, (s.weight for s in stopsets))
 
         # Randomly select stopsets and make sure they have rotators
-        while stopsets:
-            potential_stopset = random.choices(stopsets, weights=[float(s.weight) for s in stopsets], k=1)[0]
-            stopsets.remove(potential_stopset)
+        while stopset_selector:
+            potential_stopset = stopset_selector.pick()
+            stopset_selector.exclude(potential_stopset.id)
 
             rotator_and_asset_list = potential_stopset.generate_asset_block()
             if any(asset for _, asset in rotator_and_asset_list):
@@ -221,6 +246,7 @@ class ModelsAPI(APIBase):
                         'name': asset.name,
                         'url': asset.audio.url,
                         'length': asset.duration.total_seconds(),
+                        'peaks': asset.waveform_peaks,
                     })
                 else:
                     context['errors'].append(f"Stop set {stopset.name}'s rotator {rotator.name} "
@@ -242,20 +268,40 @@ class ModelsAPI(APIBase):
 
     def sync(self):
         self._execute_js_func('reportSyncProgress', 0)
-        data = make_request('get', 'export')
+
+        # Only ask for what changed since our last sync, if we've got a complete catalog. The
+        # server's ETag for export is its catalog version, so nothing gets sent if it's unchanged.
+        params, extra_headers = {'format': COLUMNAR_FORMAT}, {}
+        if self.conf.catalog_version is not None and self.conf.last_sync:
+            params['since'] = self.conf.catalog_version
+            extra_headers['If-None-Match'] = f'"{self.conf.catalog_version}"'
+        data = make_request('get', 'export', extra_headers=extra_headers, params=params)
+
+        if data is None:
+            logger.info(f'sync: Catalog unchanged since version {self.conf.catalog_version}, nothing to do')
+            self._execute_js_func('reportSyncProgress', 100)
+            self.conf.last_sync = datetime.datetime.now().strftime('%c')
+            return
 
         # 3% done after API response
         self._execute_js_func('reportSyncProgress', 3)
         self._sync_log('Starting')
 
-        deserialized_objs = list(deserialize('python', data['objects']))
+        if data.get('format') == COLUMNAR_FORMAT:
+            deserialized_objs = list(decode_tables(data['tables']))
+        else:
+            deserialized_objs = list(deserialize('python', data['objects']))
         bytes_synced = 0
         time_before = time.time()
 
         deserialized_assets = list(filter(lambda do: isinstance(do.object, Asset), deserialized_objs))
+        local_paths_by_hash = {
+            audio_hash: os.path.join(constants.MEDIA_DIR, audio.replace('/', os.path.sep))
+            for audio_hash, audio in Asset.objects.exclude(audio_hash='').values_list('audio_hash', 'audio')}
 
         for num_assets, deserialized_asset in enumerate(deserialized_assets, 1):
-            bytes_synced += self._download_asset_audio(data['media_url'], deserialized_asset.object)
+            bytes_synced += self._download_asset_audio(
+                data['media_url'], deserialized_asset.object, local_paths_by_hash)
             # 99% done after assets sync'd
             self._execute_js_func('reportSyncProgress', 3 + (num_assets / len(deserialized_assets)) * 96)
         self._execute_js_func('reportSyncProgress', 99)
@@ -270,13 +316,23 @@ class ModelsAPI(APIBase):
                 pks[deserialized_obj.object.__class__].append(deserialized_obj.object.pk)
                 deserialized_obj.save()
 
-            for model in (Asset, Rotator, StopSet, StopSetRotator):
-                model.objects.exclude(pk__in=pks[model]).delete()
+            if data['delta']:
+                for model_label, deleted_pks in data['deleted'].items():
+                    apps.get_model(model_label).objects.filter(pk__in=deleted_pks).delete()
+                logger.info(f'sync: Delta sync since version {params["since"]}, {len(deserialized_objs)} '
+                            f'objects changed, {sum(map(len, data["deleted"].values()))} deleted')
+            else:
+                for model in (Asset, Rotator, StopSet, StopSetRotator):
+                    model.objects.exclude(pk__in=pks[model]).delete()
+
+            # Keeps cached asset selectors (see models.Rotator.get_asset_selector) in step with the catalog
+            CatalogVersion.objects.filter(id=CatalogVersion.SINGLETON_ID).update(version=data['version'])
 
         # 100% after DB sync'd
         self._execute_js_func('reportSyncProgress', 100)
 
         self.conf.update(
+            catalog_version=data['version'],
             last_sync=datetime.datetime.now().strftime('%c'),
             **data['conf'],
         )
@@ -14,6 +14,7 @@ class Config:
     DEFAULTS = {
         'audio_device': None,
         'auth_token': None,
+        'catalog_version': None,
         'height': WINDOW_SIZE_DEFAULT_HEIGHT,
         'hostname': None,
         'last_sync': None,
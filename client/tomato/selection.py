@@ -0,0 +1 @@
+../../common/selection.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../common/waveform.py
\ No newline at end of file
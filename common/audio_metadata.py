@@ -0,0 +1,310 @@
+from collections import namedtuple
+import os
+import struct
+
+
+AudioProbe = namedtuple('AudioProbe', ('mime', 'file_type', 'duration', 'tags'))
+
+# Only tags we use, as named by soxi
+ID3_TAGS = {'TIT2': 'title', 'TPE1': 'artist', 'TT2': 'title', 'TP1': 'artist'}
+RIFF_INFO_TAGS = {b'INAM': 'title', b'IART': 'artist'}
+
+MP3_BITRATES = {
+    # MPEG-1 and MPEG-2/2.5 layer III, in kbps
+    3: (None, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, None),
+    2: (None, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, None),
+}
+MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+MP3_SYNC_SEARCH_SIZE = 64 * 1024
+# Consecutive matching frame headers needed before trusting a sync, since any 0xFF byte could start one
+MP3_SYNC_FRAMES = 4
+MP3_MAX_FRAME_SIZE = 1441  # 320kbps at 32kHz, padded
+OGG_LAST_PAGE_SEARCH_SIZE = 64 * 1024
+
+
+class AudioMetadataError(Exception):
+    pass
+
+
+def read_audio_metadata(path):
+    """Read type, duration and artist/title tags of an MP3, WAV, Ogg Vorbis or FLAC file from
+    its headers only, returning None if the file isn't one we understand"""
+    try:
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            head = file.read(12)
+
+            if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+                return read_wav(file)
+            elif head[:4] == b'OggS':
+                return read_ogg_vorbis(file, size)
+
+            file.seek(0)
+            id3_tags, offset = read_id3v2(file)
+            file.seek(offset)
+            if file.read(4) == b'fLaC':
+                return read_flac(file, id3_tags)
+            return read_mp3(file, size, offset, id3_tags)
+
+    except (AudioMetadataError, struct.error, UnicodeDecodeError):
+        return None
+
+
+def unpack_from_file(file, fmt):
+    return struct.unpack(fmt, file.read(struct.calcsize(fmt)))
+
+
+def parse_vorbis_comments(data):
+    # Shared by FLAC and Ogg Vorbis
+    vendor_len, = struct.unpack_from('<I', data)
+    offset = 4 + vendor_len
+    count, = struct.unpack_from('<I', data, offset)
+    offset += 4
+
+    tags = {}
+    for _ in range(count):
+        comment_len, = struct.unpack_from('<I', data, offset)
+        comment = data[offset + 4:offset + 4 + comment_len].decode('utf8', 'replace')
+        offset += 4 + comment_len
+
+        key, sep, value = comment.partition('=')
+        if sep and key.lower() in ('artist', 'title'):
+            tags.setdefault(key.lower(), value)
+    return tags
+
+
+def read_wav(file):
+    byte_rate = data_size = None
+    tags = {}
+
+    while True:
+        header = file.read(8)
+        if len(header) < 8:
+            break
+        chunk_id, chunk_size = struct.unpack('<4sI', header)
+        next_chunk = file.tell() + chunk_size + (chunk_size & 1)
+
+        if chunk_id == b'fmt ':
+            _, _, _, byte_rate = unpack_from_file(file, '<HHII')
+        elif chunk_id == b'data':
+            data_size = chunk_size
+        elif chunk_id == b'LIST' and file.read(4) == b'INFO':
+            info = file.read(chunk_size - 4)
+            offset = 0
+            while offset + 8 <= len(info):
+                sub_id, sub_size = struct.unpack_from('<4sI', info, offset)
+                if sub_id in RIFF_INFO_TAGS:
+                    value = info[offset + 8:offset + 8 + sub_size].rstrip(b'\0').decode('latin1')
+                    tags[RIFF_INFO_TAGS[sub_id]] = value
+                offset += 8 + sub_size + (sub_size & 1)
+
+        file.seek(next_chunk)
+
+    if not byte_rate or data_size is None:
+        raise AudioMetadataError('No fmt or data chunk')
+
+    return AudioProbe(mime='audio/x-wav', file_type='wav', duration=data_size / byte_rate, tags=tags)
+
+
+def read_flac(file, tags):
+    duration = None
+    tags = dict(tags)
+
+    is_last = False
+    while not is_last:
+        header, = unpack_from_file(file, '>I')
+        is_last, block_type, block_size = header >> 31, (header >> 24) & 0x7f, header & 0xffffff
+
+        if block_type == 0:  # STREAMINFO
+            info = file.read(block_size)
+            if len(info) < 18:
+                raise AudioMetadataError('Truncated FLAC STREAMINFO block')
+            sample_rate = (info[10] << 12) | (info[11] << 4) | (info[12] >> 4)
+            total_samples = ((info[13] & 0x0f) << 32) | struct.unpack_from('>I', info, 14)[0]
+            if not sample_rate:
+                raise AudioMetadataError('Invalid FLAC sample rate')
+            duration = total_samples / sample_rate
+        elif block_type == 4:  # VORBIS_COMMENT
+            tags.update(parse_vorbis_comments(file.read(block_size)))
+        else:
+            file.seek(block_size, os.SEEK_CUR)
+
+    if duration is None:
+        raise AudioMetadataError('No FLAC STREAMINFO block')
+
+    return AudioProbe(mime='audio/flac', file_type='flac', duration=duration, tags=tags)
+
+
+def iter_ogg_packets(file):
+    packet = b''
+    while True:
+        header = file.read(27)
+        if len(header) < 27 or header[:4] != b'OggS':
+            return
+        segment_sizes = file.read(header[26])
+        data = file.read(sum(segment_sizes))
+
+        offset = 0
+        for segment_size in segment_sizes:
+            packet += data[offset:offset + segment_size]
+            offset += segment_size
+            if segment_size < 255:
+                yield packet
+                packet = b''
+
+
+def read_ogg_vorbis(file, size):
+    file.seek(0)
+    packets = iter_ogg_packets(file)
+
+    identification = next(packets, b'')
+    if identification[:7] != b'\x01vorbis':
+        # Opus, Speex, FLAC in Ogg, etc
+        raise AudioMetadataError('Not an Ogg Vorbis stream')
+    sample_rate, = struct.unpack_from('<I', identification, 12)
+
+    comments = next(packets, b'')
+    if comments[:7] != b'\x03vorbis':
+        raise AudioMetadataError('No Vorbis comment header')
+    tags = parse_vorbis_comments(comments[7:])
+
+    # Granule position of the last page is the total number of samples
+    file.seek(max(0, size - OGG_LAST_PAGE_SEARCH_SIZE))
+    tail = file.read()
+    last_page = tail.rfind(b'OggS')
+    if last_page == -1 or not sample_rate:
+        raise AudioMetadataError('No final Ogg page')
+    granule_position, = struct.unpack_from('<q', tail, last_page + 6)
+
+    return AudioProbe(mime='audio/ogg', file_type='vorbis', duration=granule_position / sample_rate, tags=tags)
+
+
+def decode_id3_text(data):
+    encoding, text = data[:1], data[1:]
+    if encoding == b'\x01':
+        value = text.decode('utf16')
+    elif encoding == b'\x02':
+        value = text.decode('utf-16-be')
+    elif encoding == b'\x03':
+        value = text.decode('utf8')
+    else:
+        value = text.decode('latin1')
+    return value.split('\0', 1)[0]
+
+
+def read_id3v2(file):
+    """Returns artist/title tags of an ID3v2 tag at the current position and the offset where
+    the audio starts after it"""
+    header = file.read(10)
+    if len(header) < 10 or header[:3] != b'ID3':
+        return {}, 0
+
+    major_version, flags = header[3], header[5]
+    tag_size = sum(byte << (7 * (3 - num)) for num, byte in enumerate(header[6:10]))
+    offset = 10 + tag_size + (10 if flags & 0x10 else 0)
+
+    tags = {}
+    if not flags & 0x80:  # Unsynchronised tags are rare enough to not bother reading
+        data = file.read(tag_size)
+        id_len, header_len = (3, 6) if major_version == 2 else (4, 10)
+        pos = 0
+        while pos + header_len <= len(data) and data[pos:pos + 1] != b'\0':
+            frame_id = data[pos:pos + id_len].decode('latin1')
+            if major_version == 2:
+                frame_size = int.from_bytes(data[pos + 3:pos + 6], 'big')
+            elif major_version == 4:
+                frame_size = sum(byte << (7 * (3 - num)) for num, byte in enumerate(data[pos + 4:pos + 8]))
+            else:
+                frame_size = int.from_bytes(data[pos + 4:pos + 8], 'big')
+
+            # Skip compressed, encrypted or (v2.4) unsynchronised frames
+            frame_flags = {2: 0, 3: data[pos + 9] & 0xc0, 4: data[pos + 9] & 0x0e}.get(major_version, 0)
+            if frame_id in ID3_TAGS and not frame_flags:
+                frame_data = data[pos + header_len:pos + header_len + frame_size]
+                tags.setdefault(ID3_TAGS[frame_id], decode_id3_text(frame_data))
+            pos += header_len + frame_size
+
+    return tags, offset
+
+
+def parse_mp3_frame_header(header):
+    if len(header) < 4 or header[0] != 0xff or header[1] & 0xe0 != 0xe0:
+        return None
+
+    version, layer = (header[1] >> 3) & 0x3, (header[1] >> 1) & 0x3
+    bitrate_index, sample_rate_index, padding = header[2] >> 4, (header[2] >> 2) & 0x3, (header[2] >> 1) & 0x1
+    if version == 1 or layer != 1 or sample_rate_index == 3:  # Reserved, or not layer III
+        return None
+
+    bitrate = MP3_BITRATES[3 if version == 3 else 2][bitrate_index]
+    if bitrate is None:
+        return None
+
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    samples_per_frame = 1152 if version == 3 else 576
+    frame_size = samples_per_frame // 8 * bitrate * 1000 // sample_rate + padding
+    is_mono = header[3] >> 6 == 3
+    side_info_size = (17 if is_mono else 32) if version == 3 else (9 if is_mono else 17)
+
+    return {'version': version, 'bitrate': bitrate, 'sample_rate': sample_rate,
+            'samples_per_frame': samples_per_frame, 'frame_size': frame_size, 'side_info_size': side_info_size}
+
+
+def is_mp3_frame_sync(data, pos, frame, audio_end):
+    """Whether the frame at pos is followed by enough others of the same version and sample rate,
+    or by the end of the audio, to be the real start of it rather than junk that looks like it"""
+    for _ in range(MP3_SYNC_FRAMES - 1):
+        pos += frame['frame_size']
+        if pos == audio_end:
+            return True
+        next_frame = parse_mp3_frame_header(data[pos:pos + 4])
+        if not next_frame or (next_frame['version'], next_frame['sample_rate']) != (
+                frame['version'], frame['sample_rate']):
+            return False
+    return True
+
+
+def read_mp3(file, size, offset, tags):
+    file.seek(max(0, size - 128))
+    id3v1 = file.read(128)
+    has_id3v1 = size - offset >= 128 and id3v1[:3] == b'TAG'
+    audio_end = size - offset - (128 if has_id3v1 else 0)
+
+    # Read enough past the search window to check the frames following a header found near its end
+    file.seek(offset)
+    data = file.read(MP3_SYNC_SEARCH_SIZE + MP3_SYNC_FRAMES * MP3_MAX_FRAME_SIZE)
+
+    pos = data.find(b'\xff', 0, MP3_SYNC_SEARCH_SIZE)
+    while pos != -1:
+        frame = parse_mp3_frame_header(data[pos:pos + 4])
+        if frame and is_mp3_frame_sync(data, pos, frame, audio_end):
+            break
+        pos = data.find(b'\xff', pos + 1, MP3_SYNC_SEARCH_SIZE)
+    else:
+        raise AudioMetadataError('No MPEG audio frame found')
+
+    tags = dict(tags)
+    audio_size = size - offset - pos
+    if has_id3v1:
+        audio_size -= 128
+        for key, value in (('title', id3v1[3:33]), ('artist', id3v1[33:63])):
+            value = value.split(b'\0', 1)[0].decode('latin1').strip()
+            if value:
+                tags.setdefault(key, value)
+
+    # VBR files have a frame count in a Xing/Info or VBRI header in the first frame
+    num_frames = None
+    xing_pos = pos + 4 + frame['side_info_size']
+    if data[xing_pos:xing_pos + 4] in (b'Xing', b'Info'):
+        xing_flags, = struct.unpack_from('>I', data, xing_pos + 4)
+        if xing_flags & 0x1:
+            num_frames, = struct.unpack_from('>I', data, xing_pos + 8)
+    elif data[pos + 36:pos + 40] == b'VBRI':
+        num_frames, = struct.unpack_from('>I', data, pos + 50)
+
+    if num_frames is not None:
+        duration = num_frames * frame['samples_per_frame'] / frame['sample_rate']
+    else:
+        duration = audio_size * 8 / (frame['bitrate'] * 1000)
+
+    return AudioProbe(mime='audio/mpeg', file_type='mp3', duration=duration, tags=tags)
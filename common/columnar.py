@@ -0,0 +1,99 @@
+import datetime
+
+from django.apps import apps
+from django.core.serializers.base import DeserializedObject
+from django.db import models
+
+
+COLUMNAR_CONTENT_TYPE = 'application/vnd.tomato.columnar+json'
+COLUMNAR_FORMAT = 'columnar'
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def get_fields(model):
+    return [field for field in model._meta.local_fields if field.serialize or field.primary_key]
+
+
+def get_m2m_fields(model):
+    return [field for field in model._meta.many_to_many
+            if field.serialize and field.remote_field.through._meta.auto_created]
+
+
+def encode_value(field, value):
+    if value is None:
+        return None
+    elif isinstance(field, models.BooleanField):
+        return int(value)
+    elif isinstance(field, models.DateTimeField):
+        return round((value - EPOCH).total_seconds() * 1000)
+    elif isinstance(field, models.DurationField):
+        return round(value.total_seconds() * 1000)
+    elif isinstance(field, models.DecimalField):
+        return int(value.scaleb(field.decimal_places))
+    else:
+        return value
+
+
+def decode_value(field, value):
+    if value is None:
+        return None
+    elif isinstance(field, models.BooleanField):
+        return bool(value)
+    elif isinstance(field, models.DateTimeField):
+        return EPOCH + datetime.timedelta(milliseconds=value)
+    elif isinstance(field, models.DurationField):
+        return datetime.timedelta(milliseconds=value)
+    elif isinstance(field, models.DecimalField):
+        return field.to_python(value).scaleb(-field.decimal_places)
+    else:
+        return value
+
+
+def get_lookups(model):
+    """Fields with choices are sent as indexes into a lookup table of their choices"""
+    return {field.attname: [choice for choice, _ in field.flatchoices] for field in get_fields(model) if field.choices}
+
+
+def encode_block(rows, model, lookups, m2m_pks):
+    """Encode a chunk of values_list() rows of get_fields(model) as a column per field. Fields in
+    lookups are sent as indexes into them, and many-to-many fields as lists of pks."""
+    columns = {}
+    indexes = {attname: {choice: index for index, choice in enumerate(choices)}
+               for attname, choices in lookups.items()}
+
+    for field, values in zip(get_fields(model), zip(*rows)):
+        if field.attname in indexes:
+            columns[field.attname] = [indexes[field.attname].get(value) for value in values]
+        else:
+            columns[field.attname] = [encode_value(field, value) for value in values]
+
+    pks = columns[model._meta.pk.attname]
+    for field in get_m2m_fields(model):
+        columns[field.name] = [m2m_pks[field].get(pk, []) for pk in pks]
+
+    return columns
+
+
+def decode_tables(tables):
+    """Decode tables of {'lookups': get_lookups(), 'blocks': [encode_block(), ...]} keyed by
+    model label into DeserializedObjects, as if they came from django.core.serializers.deserialize()"""
+    for model_label, table in tables.items():
+        model = apps.get_model(model_label)
+        lookups = table['lookups']
+
+        for columns in table['blocks']:
+            decoded_columns = {}
+            for field in get_fields(model):
+                values = columns[field.attname]
+                if field.attname in lookups:
+                    lookup = lookups[field.attname]
+                    decoded_columns[field.attname] = [None if index is None else lookup[index] for index in values]
+                else:
+                    decoded_columns[field.attname] = [decode_value(field, value) for value in values]
+
+            m2m_columns = {field.name: columns[field.name] for field in get_m2m_fields(model)}
+
+            for num in range(len(columns[model._meta.pk.attname])):
+                yield DeserializedObject(
+                    model(**{attname: values[num] for attname, values in decoded_columns.items()}),
+                    m2m_data={name: values[num] for name, values in m2m_columns.items()})
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.18 on 2026-10-17 11:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tomato', '0002_catalog_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch', models.UUIDField(db_index=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10, verbose_name='Status')),
+                ('filename', models.CharField(max_length=255, verbose_name='Filename')),
+                ('audio', models.FileField(blank=True, upload_to='staging/')),
+                ('errors', models.TextField(blank=True)),
+                ('asset', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='tomato.asset')),
+                ('rotators', models.ManyToManyField(blank=True, related_name='_tomato_uploadjob_rotators_+', to='tomato.Rotator')),
+            ],
+            options={
+                'verbose_name': 'Audio Upload Job',
+                'verbose_name_plural': 'Audio Upload Jobs',
+                'db_table': 'upload_jobs',
+                'ordering': ('created', 'id'),
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 3.2.18 on 2026-10-17 11:55
+
+from django.db import migrations, models
+import tomato.models
+
+
+def hash_existing_audio(apps, schema_editor):
+    # Existing files stay where they are, but get hashes so new uploads can reuse them. Only on the
+    # server (the only side with sox), since clients get the hashes in their next sync.
+    if not tomato.models.HAVE_SOX:
+        return
+
+    Asset = apps.get_model('tomato', 'Asset')
+    CatalogVersion = apps.get_model('tomato', 'CatalogVersion')
+
+    assets = [asset for asset in Asset.objects.all() if asset.audio.storage.exists(asset.audio.name)]
+    if assets:
+        CatalogVersion.objects.filter(id=1).update(version=models.F('version') + 1)
+        version = CatalogVersion.objects.get(id=1).version
+
+        for asset in assets:
+            with asset.audio.open('rb'):
+                asset.audio_hash = tomato.models.get_file_hash(asset.audio)
+            asset.version = version
+            asset.save(update_fields=('audio_hash', 'version'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tomato', '0003_upload_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asset',
+            name='audio_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='audio_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='asset',
+            name='audio',
+            field=models.FileField(upload_to=tomato.models.get_audio_upload_to, verbose_name='Audio File'),
+        ),
+        migrations.RunPython(hash_existing_audio, migrations.RunPython.noop),
+    ]
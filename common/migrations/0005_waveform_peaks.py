@@ -0,0 +1,18 @@
+# Generated by Django 3.2.18 on 2026-10-17 11:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tomato', '0004_audio_hashes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asset',
+            name='waveform_peaks',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 3.2.18 on 2026-10-17 12:08
+
+import datetime
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce, TruncDate
+import pytz
+import tomato.models
+
+
+def rollup_existing_log_entries(apps, schema_editor):
+    # Only the server (the only side with sox) reports on log entries
+    if not tomato.models.HAVE_SOX:
+        return
+
+    LogEntry = apps.get_model('tomato', 'LogEntry')
+    LogEntryRollup = apps.get_model('tomato', 'LogEntryRollup')
+    if not LogEntry.objects.exists():
+        return
+
+    # Days in the station's timezone, same as rollups of new entries pushed while it's active
+    from constance import config
+
+    try:
+        tz = pytz.timezone(config.TIMEZONE)
+    except pytz.UnknownTimeZoneError:
+        tz = pytz.timezone(settings.TIME_ZONE)
+
+    totals = LogEntry.objects.annotate(
+        day=TruncDate('created', tzinfo=tz),
+    ).values('day', 'action', 'user_id', 'description').annotate(
+        count=models.Count('id'),
+        total_duration=Coalesce(models.Sum('duration'), datetime.timedelta(0)),
+    ).order_by()
+
+    LogEntryRollup.objects.bulk_create((
+        LogEntryRollup(day=total['day'], action=total['action'], user_id=total['user_id'],
+                       description=total['description'], count=total['count'], duration=total['total_duration'])
+        for total in totals.iterator()), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tomato', '0005_waveform_peaks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogEntryRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Date')),
+                ('action', models.CharField(choices=[('added_asset', 'Added an Audio Asset'), ('added_rotator', 'Added a Rotator'), ('added_stopset', 'Added a Stop Set'), ('edited_asset', 'Edited an Audio Asset'), ('edited_rotator', 'Edited a Rotator'), ('edited_stopset', 'Edited a Stop Set'), ('played_asset', 'Played an Audio Asset'), ('played_part_stopset', 'Played a partial Stop Set'), ('played_stopset', 'Played an entire Stop Set'), ('skipped_asset', 'Skipped playing an Audio Asset'), ('skipped_stopset', 'Skipped playing an entire Stop Set'), ('waited', 'Waited')], max_length=19, verbose_name='Action Taken')),
+                ('user_id', models.IntegerField(null=True)),
+                ('description', models.CharField(blank=True, max_length=255, verbose_name='Description (if any)')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Count')),
+                ('duration', models.DurationField(default=datetime.timedelta(0), verbose_name='Total Duration')),
+            ],
+            options={
+                'verbose_name': 'Daily Log Entry Total',
+                'verbose_name_plural': 'Daily Log Entry Totals',
+                'db_table': 'log_entry_rollups',
+                'ordering': ('-day', 'action', 'description'),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='logentryrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'action', 'user_id', 'description'), name='log_entry_rollup_key'),
+        ),
+        migrations.RunPython(rollup_existing_log_entries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.18 on 2026-10-17 12:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tomato', '0006_log_entry_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='asset',
+            index=models.Index(condition=models.Q(('enabled', True)), fields=['begin', 'end'], name='assets_enabled_airing'),
+        ),
+        migrations.AddIndex(
+            model_name='logentry',
+            index=models.Index(fields=['-created'], name='log_entries_created'),
+        ),
+        migrations.AddIndex(
+            model_name='logentry',
+            index=models.Index(fields=['action', '-created'], name='log_entries_action_created'),
+        ),
+        migrations.AddIndex(
+            model_name='stopset',
+            index=models.Index(condition=models.Q(('enabled', True)), fields=['begin', 'end'], name='stopsets_enabled_airing'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.18 on 2026-10-17 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tomato', '0007_eligibility_and_log_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadjob',
+            name='trimmed',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.18 on 2026-10-17 12:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tomato', '0008_upload_job_trimmed'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='logentryrollup',
+            name='log_entry_rollup_key',
+        ),
+        migrations.AddConstraint(
+            model_name='logentryrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('user_id__isnull', False)), fields=('day', 'action', 'user_id', 'description'), name='log_entry_rollup_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='logentryrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('user_id__isnull', True)), fields=('day', 'action', 'description'), name='log_entry_rollup_key_no_user'),
+        ),
+    ]
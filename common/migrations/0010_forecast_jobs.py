@@ -0,0 +1,34 @@
+# Generated by Django 3.2.18 on 2026-10-17 12:48
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tomato', '0009_log_entry_rollup_null_user_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ForecastJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10, verbose_name='Status')),
+                ('begin', models.DateTimeField(verbose_name='Begin')),
+                ('end', models.DateTimeField(verbose_name='End')),
+                ('trials', models.PositiveIntegerField(verbose_name='Trials')),
+                ('forecast', models.TextField(blank=True)),
+                ('errors', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name': 'Playout Forecast Job',
+                'verbose_name_plural': 'Playout Forecast Jobs',
+                'db_table': 'forecast_jobs',
+                'ordering': ('created', 'id'),
+            },
+        ),
+    ]
@@ -1,6 +1,7 @@
+from concurrent.futures import ThreadPoolExecutor
 import datetime
+import hashlib
 import os
-import random
 import subprocess
 import uuid as uuid_module
 
@@ -12,14 +13,75 @@ except ImportError:
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
-from django.core.files.uploadedfile import TemporaryUploadedFile
-from django.db import models
+from django.core.files import File
+from django.db import models, router, transaction
 from django.db.migrations.recorder import MigrationRecorder
+from django.db.models.functions import RowNumber
+from django.db.models.signals import m2m_changed
 from django.utils import timezone
 
+from .audio_metadata import read_audio_metadata, AudioProbe
 from .client_server_constants import ACTION_CHOICES, COLORS
+from .selection import is_currently_airing, pick_asset_block, SelectionCache
+from .waveform import get_waveform_peaks
 
 MAX_NAME_LEN = 75
+# Per rotator asset selectors, keyed by catalog version and eligibility window
+asset_selection_cache = SelectionCache()
+
+
+TRIM_MIN_SILENCE_SECONDS = 0.1
+
+
+if HAVE_SOX:
+    def probe_audio_file(path):
+        # Read headers in-process if we can, falling back to file and soxi for anything else
+        return read_audio_metadata(path) or probe_audio_file_with_sox(path)
+
+    def trim_audio_file(path, trimmed_path):
+        # Same as: sox in.wav out.wav silence 1 0.1 1% reverse silence 1 0.1 1% reverse
+        transformer = sox.Transformer()
+        transformer.silence(location=1, silence_threshold=1, min_silence_duration=TRIM_MIN_SILENCE_SECONDS)
+        transformer.silence(location=-1, silence_threshold=1, min_silence_duration=TRIM_MIN_SILENCE_SECONDS)
+        transformer.build_file(path, trimmed_path)
+
+    def probe_audio_file_with_sox(path):
+        mime = subprocess.check_output(['file', '--mime-type', '--brief', path]).decode().strip()
+
+        try:
+            file_type = sox.file_info.file_type(path).lower()
+        except sox.SoxiError:
+            # Likely an invalid/corrupt file
+            return AudioProbe(mime=mime, file_type=None, duration=None, tags={})
+
+        tags = {}
+        for comment in sox.file_info.comments(path).strip().splitlines():
+            comment_parts = comment.split('=', 1)
+            if len(comment_parts) == 2:
+                tags[comment_parts[0].lower()] = comment_parts[1]
+
+        return AudioProbe(mime=mime, file_type=file_type, duration=sox.file_info.duration(path), tags=tags)
+
+
+def validate_audio_extension(name):
+    if os.path.splitext(name)[1].lower() not in settings.VALID_AUDIO_FILE_TYPES:
+        valid_types = (', '.join(settings.VALID_AUDIO_FILE_TYPES.keys())).upper()
+        raise ValidationError({'audio': f"Invalid file extension: '{name}'. Valid extensions: {valid_types}."})
+
+
+def get_file_hash(file):
+    sha256 = hashlib.sha256()
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_audio_upload_to(instance, filename):
+    # Content addressed, keeping the original filename for readability. Files saved directly to
+    # the field, before the asset's save() hashed them, go where they always did.
+    if not instance.audio_hash:
+        return f'assets/{filename}'
+    return f'assets/{instance.audio_hash[:2]}/{instance.audio_hash}/{filename}'
 
 
 def get_latest_tomato_migration():
@@ -29,21 +91,74 @@ def get_latest_tomato_migration():
         return None
 
 
+def get_catalog_version():
+    return CatalogVersion.objects.values_list('version', flat=True).first() or 0
+
+
+def next_catalog_version():
+    # Must run in the same transaction as the writes it versions. The UPDATE then holds a row lock
+    # until they commit, so writers to the catalog are serialized and versions become visible to
+    # readers in increasing order, along with the rows stamped with them.
+    if not transaction.get_connection().in_atomic_block:
+        raise transaction.TransactionManagementError('next_catalog_version() must be called in a transaction')
+    CatalogVersion.objects.filter(id=CatalogVersion.SINGLETON_ID).update(version=models.F('version') + 1)
+    return get_catalog_version()
+
+
+class CatalogVersion(models.Model):
+    SINGLETON_ID = 1
+
+    version = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'catalog_version'
+
+
+class ChangeTrackedMixin(models.Model):
+    version = models.BigIntegerField(default=0, db_index=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        # The version is bumped by a pre_save signal, which Django sends before its own transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    class Meta:
+        abstract = True
+
+
+class Tombstone(models.Model):
+    model = models.CharField(max_length=50)
+    object_id = models.IntegerField()
+    version = models.BigIntegerField(db_index=True)
+
+    def __str__(self):
+        return f'{self.model} #{self.object_id} deleted'
+
+    class Meta:
+        db_table = 'tombstones'
+
+
+def currently_airing_q(now=None, prefix=''):
+    # Optional prefix is for filtering on a related model, eg 'assets__'
+    if now is None:
+        now = timezone.now()
+    return ((models.Q(**{f'{prefix}begin__isnull': True}) | models.Q(**{f'{prefix}begin__lte': now}))
+            & (models.Q(**{f'{prefix}end__isnull': True}) | models.Q(**{f'{prefix}end__gte': now})))
+
+
+def currently_enabled_q(now=None, prefix=''):
+    return models.Q(**{f'{prefix}enabled': True}) & currently_airing_q(now, prefix)
+
+
 class CurrentlyEnabledQueryset(models.QuerySet):
     def currently_airing(self, now=None):
-        if now is None:
-            now = timezone.now()
-        return self.filter((models.Q(begin__isnull=True) | models.Q(begin__lte=now))
-                           & (models.Q(end__isnull=True) | models.Q(end__gte=now)))
+        return self.filter(currently_airing_q(now))
 
     def not_currently_airing(self, now=None):
-        if now is None:
-            now = timezone.now()
-        return self.exclude((models.Q(begin__isnull=True) | models.Q(begin__lte=now))
-                            & (models.Q(end__isnull=True) | models.Q(end__gte=now)))
+        return self.exclude(currently_airing_q(now))
 
     def currently_enabled(self, now=None):
-        return self.filter(enabled=True).currently_airing(now=now)
+        return self.filter(currently_enabled_q(now))
 
 
 class EnabledBeginEndWeightMixin(models.Model):
@@ -71,14 +186,7 @@ class EnabledBeginEndWeightMixin(models.Model):
     def currently_airing(self, now=None):
         if now is None:
             now = timezone.now()
-        if self.begin and self.end:
-            return self.begin <= now <= self.end
-        elif self.begin:
-            return self.begin <= now
-        elif self.end:
-            return self.end >= now
-        else:
-            return True
+        return is_currently_airing(self.begin, self.end, now)
 
     def save(self, *args, **kwargs):
         if self.weight <= 0:
@@ -89,7 +197,7 @@ class EnabledBeginEndWeightMixin(models.Model):
         abstract = True
 
 
-class StopSet(EnabledBeginEndWeightMixin, models.Model):
+class StopSet(EnabledBeginEndWeightMixin, ChangeTrackedMixin, models.Model):
     name = models.CharField('Name', max_length=MAX_NAME_LEN)
 
     def __str__(self):
@@ -101,44 +209,29 @@ class StopSet(EnabledBeginEndWeightMixin, models.Model):
         if not rotators:
             return []
 
-        rotator_assets = {
-            rotator: list(rotator.assets.currently_enabled(now=now))
-            # Instantiate one list of assets per rotator
-            for rotator in set(rotators)
-        }
-
-        asset_block = []
-        for rotator in rotators:
-            assets = rotator_assets[rotator]
-            if assets:
-                # Pick a random asset according to its weight
-                asset = random.choices(assets, weights=[float(a.weight) for a in assets], k=1)[0]
-
-                # Remove asset from being eligible to play again in this block, even if it's
-                # part of another rotator
-                for assets in rotator_assets.values():
-                    try:
-                        assets.remove(asset)
-                    except ValueError:
-                        pass
-
-            else:
-                asset = None
-
-            asset_block.append(asset)
+        if now is None:
+            now = timezone.now()
+        version = get_catalog_version()
+        # One (cached, then copied) selector per rotator
+        rotator_selectors = {rotator: rotator.get_asset_selector(now, version) for rotator in set(rotators)}
 
-        return list(zip(rotators, asset_block))
+        return list(zip(rotators, pick_asset_block(rotators, rotator_selectors)))
 
     def get_rotator_block(self):
-        return [ssr.rotator for ssr in StopSetRotator.objects.filter(stopset=self).order_by('id')]
+        return [ssr.rotator for ssr in StopSetRotator.objects.filter(
+            stopset=self).select_related('rotator').order_by('id')]
 
     class Meta:
         db_table = 'stopsets'
         verbose_name = 'Stop Set'
         verbose_name_plural = 'Stop Sets'
+        indexes = (
+            # For currently_enabled(), which only ever wants enabled rows
+            models.Index(fields=('begin', 'end'), condition=models.Q(enabled=True), name='stopsets_enabled_airing'),
+        )
 
 
-class Rotator(models.Model):
+class Rotator(ChangeTrackedMixin, models.Model):
     COLOR_CHOICES = tuple(
         (name, name.replace('-', ' ').title()) for name, _ in COLORS
         if not name.endswith('-light') and not name.endswith('-dark'))
@@ -155,6 +248,31 @@ class Rotator(models.Model):
     def __str__(self):
         return self.name
 
+    def get_asset_selector(self, now, version):
+        return asset_selection_cache.get_selector(
+            self.id, now, version, lambda: list(self.assets.filter(enabled=True).order_by('id')))
+
+    def add_assets(self, asset_ids):
+        # A single insert, rather than self.assets.add() checking which exist first. Sends the same
+        # m2m_changed signal so changes are still tracked.
+        through = Asset.rotators.through
+        asset_ids = set(asset_ids)
+        db = router.db_for_write(through)
+        with transaction.atomic(using=db):
+            through.objects.bulk_create((through(asset_id=asset_id, rotator_id=self.id) for asset_id in asset_ids),
+                                        ignore_conflicts=True)
+            m2m_changed.send(sender=through, instance=self, action='post_add', reverse=True, model=Asset,
+                             pk_set=asset_ids, using=db)
+
+    def remove_assets(self, asset_ids):
+        through = Asset.rotators.through
+        asset_ids = set(asset_ids)
+        db = router.db_for_write(through)
+        with transaction.atomic(using=db):
+            through.objects.filter(rotator_id=self.id, asset_id__in=asset_ids).delete()
+            m2m_changed.send(sender=through, instance=self, action='post_remove', reverse=True, model=Asset,
+                             pk_set=asset_ids, using=db)
+
     class Meta:
         db_table = 'rotators'
         verbose_name = 'Rotator'
@@ -162,14 +280,26 @@ class Rotator(models.Model):
         ordering = ('name',)
 
 
-class StopSetRotator(models.Model):
+class StopSetRotatorQueryset(models.QuerySet):
+    def with_position(self):
+        # Number each entry within its stop set. Since this is computed over the rows selected,
+        # only filter by stop set, ie not by id.
+        return self.annotate(position=models.Window(
+            RowNumber(), partition_by=models.F('stopset'), order_by=models.F('id').asc()))
+
+
+class StopSetRotator(ChangeTrackedMixin, models.Model):
+    objects = StopSetRotatorQueryset.as_manager()
+
     stopset = models.ForeignKey(StopSet, on_delete=models.CASCADE)
     rotator = models.ForeignKey(Rotator, on_delete=models.CASCADE, verbose_name='Rotator')
 
     def __str__(self):
         s = f'{self.rotator.name} in {self.stopset.name}'
         if self.id:
-            num = StopSetRotator.objects.filter(stopset=self.stopset, id__lte=self.id).count()
+            num = getattr(self, 'position', None)
+            if num is None:
+                num = StopSetRotator.objects.filter(stopset=self.stopset, id__lte=self.id).count()
             s = f'{num}. {s}'
         return s
 
@@ -180,13 +310,15 @@ class StopSetRotator(models.Model):
         ordering = ('id',)
 
 
-class Asset(EnabledBeginEndWeightMixin, models.Model):
+class Asset(EnabledBeginEndWeightMixin, ChangeTrackedMixin, models.Model):
     name = models.CharField('Name', max_length=MAX_NAME_LEN, blank=True, db_index=True,
                             help_text="Optional name, if left unspecified, we'll base it off the audio file's "
                                       'metadata, failing that its filename.')
     duration = models.DurationField()
-    audio = models.FileField('Audio File', upload_to='assets/')
+    audio = models.FileField('Audio File', upload_to=get_audio_upload_to)
     audio_size = models.BigIntegerField()
+    audio_hash = models.CharField(max_length=64, blank=True, db_index=True, editable=False)
+    waveform_peaks = models.TextField(blank=True, editable=False)
     rotators = models.ManyToManyField(Rotator, related_name='assets', blank=True, verbose_name='Rotators',
                                       help_text='Rotators that this asset will be included in.')
 
@@ -194,9 +326,6 @@ class Asset(EnabledBeginEndWeightMixin, models.Model):
         return self.name
 
     def save(self, *args, **kwargs):
-        # If first save, ie pk is None, action on:
-        # - STRIP_UPLOADED_AUDIO
-
         if HAVE_SOX:
             if not self.name.strip():
                 self.name = self.get_default_name()
@@ -205,30 +334,57 @@ class Asset(EnabledBeginEndWeightMixin, models.Model):
         self.name = self.name[:MAX_NAME_LEN]
         self.audio_size = self.audio.file.size
 
+        if not self.audio._committed or not self.audio_hash:
+            self.audio_hash = getattr(self.audio.file, 'audio_hash', None) or get_file_hash(self.audio.file)
+
+        # For a new audio file, reuse an identical one if it's already stored
+        if not self.audio._committed:
+            existing = Asset.objects.filter(audio_hash=self.audio_hash).exclude(audio='').values_list(
+                'audio', 'waveform_peaks').first()
+            if existing:
+                self.audio, self.waveform_peaks = existing
+            elif HAVE_SOX:
+                self.waveform_peaks = get_waveform_peaks(self.audio_path, settings.WAVEFORM_PEAKS_PER_SECOND)
+
         return super().save(*args, **kwargs)
 
     @property
     def audio_path(self):
         if self.audio:
-            if isinstance(self.audio.file, TemporaryUploadedFile):
+            # Uploaded or staged files that haven't been saved to storage yet
+            if hasattr(self.audio.file, 'temporary_file_path'):
                 return self.audio.file.temporary_file_path()
             else:
                 return self.audio.path
 
     if HAVE_SOX:
-        def get_duration(self):
-            duration = sox.file_info.duration(self.audio_path)
-            return datetime.timedelta(seconds=duration or 0)
+        def get_audio_probe(self):
+            # Cached, since clean() and save() both need it, and it may have been probed in bulk
+            if getattr(self, '_audio_probe', None) is None:
+                self._audio_probe = probe_audio_file(self.audio_path)
+            return self._audio_probe
+
+        @classmethod
+        def probe_audio_files(cls, assets):
+            # Probing is mostly file I/O or waiting on subprocesses, so threads are enough to spread it out
+            assets = [asset for asset in assets if asset.audio and getattr(asset, '_audio_probe', None) is None
+                      and os.path.splitext(asset.audio.name)[1].lower() in settings.VALID_AUDIO_FILE_TYPES]
+
+            def probe(asset):
+                # Left unprobed on failure, so get_audio_probe() raises the error for just that asset
+                try:
+                    asset._audio_probe = probe_audio_file(asset.audio_path)
+                except Exception:
+                    pass
 
-        def get_default_name(self, default=None):
-            tags = {}
-            comments = sox.file_info.comments(self.audio_path)
+            with ThreadPoolExecutor(max_workers=settings.AUDIO_PROCESSING_WORKERS) as executor:
+                list(executor.map(probe, assets))
 
-            for comment in comments.strip().splitlines():
-                comment_parts = comment.split('=', 1)
-                if len(comment_parts) == 2:
-                    tags[comment_parts[0].lower()] = comment_parts[1]
+        def get_duration(self):
+            return datetime.timedelta(seconds=self.get_audio_probe().duration or 0)
 
+        def get_default_name(self, default=None):
+            tags = self.get_audio_probe().tags
             artist, title = tags.get('artist'), tags.get('title')
 
             if artist and title:
@@ -240,17 +396,12 @@ class Asset(EnabledBeginEndWeightMixin, models.Model):
 
         def clean(self):
             if self.audio:
-                valid_types = (', '.join(settings.VALID_AUDIO_FILE_TYPES.keys())).upper()
+                validate_audio_extension(self.audio.name)
+                audio_ext = os.path.splitext(self.audio.name)[1].lower()
+                valid_info = settings.VALID_AUDIO_FILE_TYPES[audio_ext]
 
-                audio_path = self.audio_path
-
-                audio_ext = os.path.splitext(audio_path)[1].lower()
-                valid_info = settings.VALID_AUDIO_FILE_TYPES.get(audio_ext)
-                if not valid_info:
-                    raise ValidationError({'audio': f"Invalid file extension: '{self.audio.name}'. "
-                                                    f'Valid extensions: {valid_types}.'})
-
-                mime = subprocess.check_output(['file', '--mime-type', '--brief', audio_path]).decode().strip()
+                probe = self.get_audio_probe()
+                mime = probe.mime
                 if not (
                     (mime.startswith('audio/') and mime.endswith(valid_info['mime']))
                     # Some cases where mp3s are octet-streams because of bizarro weird encoding
@@ -260,21 +411,162 @@ class Asset(EnabledBeginEndWeightMixin, models.Model):
                     raise ValidationError({'audio': f"Detected mime type {mime} for '{self.audio.name}'. "
                                                     f'Expected {expected_mime} from extension {audio_ext}.'})
 
-                try:
-                    file_type = sox.file_info.file_type(audio_path).lower()
-                except sox.SoxiError:
+                if probe.file_type is None:
                     raise ValidationError({'audio': f"Error reading: '{self.audio.name}'. "
                                                     'Likely an invalid/corrupt audio file. Please re-encode file.'})
-                else:
-                    if file_type != valid_info['soxi']:
-                        raise ValidationError({'audio': f"Detected file type {file_type} for '{self.audio.name}'. "
-                                                        f'Expected {valid_info["soxi"]} from extension {audio_ext}.'})
+                elif probe.file_type != valid_info['soxi']:
+                    raise ValidationError({'audio': f"Detected file type {probe.file_type} for '{self.audio.name}'. "
+                                                    f'Expected {valid_info["soxi"]} from extension {audio_ext}.'})
 
     class Meta:
         db_table = 'assets'
         verbose_name = 'Audio Asset'
         verbose_name_plural = 'Audio Assets'
         ordering = ('name', 'id')
+        indexes = (
+            models.Index(fields=('begin', 'end'), condition=models.Q(enabled=True), name='assets_enabled_airing'),
+        )
+
+
+class StagedFile(File):
+    # A file already on local disk, which storage can move into place rather than copy
+    def temporary_file_path(self):
+        return self.file.name
+
+
+class QueuedJob(models.Model):
+    """Work queued from the admin, for a management command to pick up with claim()"""
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    created = models.DateTimeField(default=timezone.now)
+    updated = models.DateTimeField(default=timezone.now)
+    status = models.CharField('Status', choices=STATUS_CHOICES, default=STATUS_PENDING, max_length=10)
+
+    @classmethod
+    def claim(cls, limit, stale_timeout):
+        """Mark up to limit pending jobs as processing and return them. Each job is claimed with
+        a conditional update, so multiple workers never process the same one. Jobs that have been
+        processing for longer than stale_timeout are assumed to have lost their worker."""
+        now = timezone.now()
+        pending = cls.objects.filter(
+            models.Q(status=cls.STATUS_PENDING)
+            | models.Q(status=cls.STATUS_PROCESSING, updated__lt=now - stale_timeout))
+
+        claimed = []
+        for job in pending.order_by('created', 'id')[:limit]:
+            if cls.objects.filter(pk=job.pk, status=job.status, updated=job.updated).update(
+                    status=cls.STATUS_PROCESSING, updated=now):
+                job.status, job.updated = cls.STATUS_PROCESSING, now
+                claimed.append(job)
+        return claimed
+
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED)
+
+    class Meta:
+        abstract = True
+
+
+class UploadJob(QueuedJob):
+    batch = models.UUIDField(db_index=True)
+    filename = models.CharField('Filename', max_length=255)
+    audio = models.FileField(upload_to='staging/', blank=True)
+    audio_hash = models.CharField(max_length=64, blank=True)
+    # Silence already trimmed from the staged file, so a retried job doesn't re-encode it again
+    trimmed = models.BooleanField(default=False)
+    rotators = models.ManyToManyField(Rotator, related_name='+', blank=True)
+    asset = models.ForeignKey(Asset, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    errors = models.TextField(blank=True)
+
+    def __str__(self):
+        return self.filename
+
+    def get_asset(self):
+        audio = StagedFile(open(self.audio.path, 'rb'), name=self.filename)
+        audio.audio_hash = self.audio_hash
+        asset = Asset(audio=audio)
+        # Already probed if it was trimmed
+        asset._audio_probe = getattr(self, '_audio_probe', None)
+        return asset
+
+    if HAVE_SOX:
+        def trim_audio(self):
+            # Replaces the staged file with a trimmed one if there was any silence to trim, returning
+            # an error message on failure. Sets trimmed, but doesn't save.
+            path = self.audio.path
+            root, ext = os.path.splitext(path)
+            trimmed_path = f'{root}.trimmed{ext}'
+
+            try:
+                trim_audio_file(path, trimmed_path)
+                trimmed_probe, probe = probe_audio_file(trimmed_path), probe_audio_file(path)
+                # Re-encoding alone can nudge the duration, so it was only trimmed if it's noticeably shorter
+                if (probe.duration and trimmed_probe.duration
+                        and probe.duration - trimmed_probe.duration >= TRIM_MIN_SILENCE_SECONDS / 2):
+                    os.replace(trimmed_path, path)
+                    # Hashed as uploaded, so it no longer matches
+                    self.audio_hash = ''
+                    self._audio_probe = trimmed_probe
+                else:
+                    os.remove(trimmed_path)
+                    self._audio_probe = probe
+            except Exception as e:  # Whatever sox or pysox choke on, the untrimmed file is still usable
+                if os.path.exists(trimmed_path):
+                    os.remove(trimmed_path)
+                return f"Couldn't trim silence from '{self.filename}', using it untrimmed: {e}"
+
+            self.trimmed = True
+
+    def finish(self, asset=None, errors=()):
+        # Unless it was moved into place for the asset, the staged file is no longer needed
+        if self.audio and self.audio.storage.exists(self.audio.name):
+            self.audio.delete(save=False)
+        self.audio = ''
+        self.asset = asset
+        self.errors = '\n'.join(errors)
+        self.status = self.STATUS_FAILED if errors else self.STATUS_DONE
+        self.updated = timezone.now()
+        self.save()
+
+    class Meta:
+        db_table = 'upload_jobs'
+        verbose_name = 'Audio Upload Job'
+        verbose_name_plural = 'Audio Upload Jobs'
+        ordering = ('created', 'id')
+
+
+class ForecastJob(QueuedJob):
+    begin = models.DateTimeField('Begin')
+    end = models.DateTimeField('End')
+    trials = models.PositiveIntegerField('Trials')
+    # JSON from tomato.simulation.encode_forecast(), once done
+    forecast = models.TextField(blank=True)
+    errors = models.TextField(blank=True)
+
+    def __str__(self):
+        return f'Forecast from {self.begin} to {self.end}'
+
+    def finish(self, forecast='', errors=()):
+        self.forecast = forecast
+        self.errors = '\n'.join(errors)
+        self.status = self.STATUS_FAILED if errors else self.STATUS_DONE
+        self.updated = timezone.now()
+        self.save()
+
+    class Meta:
+        db_table = 'forecast_jobs'
+        verbose_name = 'Playout Forecast Job'
+        verbose_name_plural = 'Playout Forecast Jobs'
+        ordering = ('created', 'id')
 
 
 class LogEntryManager(models.Manager):
@@ -306,6 +598,78 @@ class LogEntry(models.Model):
         verbose_name = 'Client Log Entry'
         verbose_name_plural = 'Client Log Entries'
         ordering = ('-created',)
+        indexes = (
+            # The admin list and export, unfiltered and filtered by action. The second can't serve
+            # the first (or archiving by date), since its leading column is action.
+            models.Index(fields=('-created',), name='log_entries_created'),
+            models.Index(fields=('action', '-created'), name='log_entries_action_created'),
+        )
+
+
+class LogEntryRollup(models.Model):
+    """Running totals of log entries per day (in the station's timezone at the time they were
+    added), action, user and description, so reports don't need to scan every log entry"""
+    day = models.DateField('Date')
+    action = models.CharField('Action Taken', choices=ACTION_CHOICES,
+                              max_length=max(len(c) for c, _ in ACTION_CHOICES))
+    user_id = models.IntegerField(null=True)
+    description = models.CharField('Description (if any)', blank=True, max_length=LogEntry.MAX_DESCRIPTION_LEN)
+    count = models.PositiveIntegerField('Count', default=0)
+    duration = models.DurationField('Total Duration', default=datetime.timedelta(0))
+
+    KEY_FIELDS = ('day', 'action', 'user_id', 'description')
+
+    def __str__(self):
+        return f'{self.get_action_display()} totals for {self.day}'
+
+    @staticmethod
+    def get_key(log_entry):
+        return (timezone.localdate(log_entry.created), log_entry.action, log_entry.user_id, log_entry.description)
+
+    @classmethod
+    def add_log_entries(cls, log_entries):
+        totals = {}
+        for log_entry in log_entries:
+            key = cls.get_key(log_entry)
+            count, duration = totals.get(key, (0, datetime.timedelta(0)))
+            totals[key] = (count + 1, duration + (log_entry.duration or datetime.timedelta(0)))
+        if not totals:
+            return
+
+        with transaction.atomic():
+            rollups = cls.lock_rollups(totals)
+            missing = [key for key in totals if key not in rollups]
+            if missing:
+                # Another push could be creating the same rollups, so insert empty ones ignoring
+                # conflicts, then lock whichever rows won
+                cls.objects.bulk_create((cls(**dict(zip(cls.KEY_FIELDS, key))) for key in missing),
+                                        ignore_conflicts=True)
+                rollups.update(cls.lock_rollups(missing))
+
+            for key, rollup in rollups.items():
+                count, duration = totals[key]
+                rollup.count += count
+                rollup.duration += duration
+            cls.objects.bulk_update(rollups.values(), ('count', 'duration'))
+
+    @classmethod
+    def lock_rollups(cls, keys):
+        rollups = cls.objects.select_for_update().filter(
+            models.Q(*(models.Q(**dict(zip(cls.KEY_FIELDS, key))) for key in keys), _connector=models.Q.OR))
+        return {tuple(getattr(rollup, field) for field in cls.KEY_FIELDS): rollup for rollup in rollups}
+
+    class Meta:
+        db_table = 'log_entry_rollups'
+        verbose_name = 'Daily Log Entry Total'
+        verbose_name_plural = 'Daily Log Entry Totals'
+        ordering = ('-day', 'action', 'description')
+        # Entries without a user have a null user_id, and nulls are never equal in a unique constraint
+        constraints = (
+            models.UniqueConstraint(fields=('day', 'action', 'user_id', 'description'),
+                                    condition=models.Q(user_id__isnull=False), name='log_entry_rollup_key'),
+            models.UniqueConstraint(fields=('day', 'action', 'description'),
+                                    condition=models.Q(user_id__isnull=True), name='log_entry_rollup_key_no_user'),
+        )
 
 
 # For prettier admin display
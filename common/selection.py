@@ -0,0 +1,151 @@
+import bisect
+import datetime
+import random
+import threading
+
+
+# Weights are decimals with two places, so scaling them makes for exact integer arithmetic
+WEIGHT_SCALE = 100
+# Eligibility ends after an end date, ie it's inclusive
+END_RESOLUTION = datetime.timedelta(microseconds=1)
+
+
+def is_currently_airing(begin, end, now):
+    if begin and end:
+        return begin <= now <= end
+    elif begin:
+        return begin <= now
+    elif end:
+        return end >= now
+    else:
+        return True
+
+
+class WeightedSelector:
+    """Weighted random picks from a list of objects with ids, which can be excluded from
+    further picks. Weights are kept in a Fenwick tree, so picks and exclusions are O(log n).
+    The tree itself is never changed, exclusions are tracked per copy as weight removed from
+    each node, so copying is O(1) and a cached selector can be shared between threads."""
+
+    def __init__(self, objs, weights):
+        self.objs = list(objs)
+        self.positions = {obj.id: position for position, obj in enumerate(self.objs)}
+        self.weights = [max(0, int(weight * WEIGHT_SCALE)) for weight in weights]
+        self.total = sum(self.weights)
+        self.excluded, self.removed = set(), {}
+
+        # Build in O(n) by pushing each node's sum up to its parent
+        self.tree = [0] + self.weights
+        for index in range(1, len(self.tree)):
+            parent = index + (index & -index)
+            if parent < len(self.tree):
+                self.tree[parent] += self.tree[index]
+
+        self.top_step = 1 << (len(self.objs).bit_length() - 1) if self.objs else 0
+
+    def __bool__(self):
+        return self.total > 0
+
+    def copy(self):
+        selector = WeightedSelector.__new__(WeightedSelector)
+        selector.__dict__.update(self.__dict__)
+        selector.excluded, selector.removed = set(self.excluded), dict(self.removed)
+        return selector
+
+    def pick(self):
+        if self.total <= 0:
+            return None
+
+        # Walk down the tree to the first position whose cumulative weight exceeds target
+        tree, get_removed, size = self.tree, self.removed.get, len(self.tree)
+        target, position, step = random.randrange(self.total), 0, self.top_step
+        while step:
+            index = position + step
+            if index < size:
+                node = tree[index] - get_removed(index, 0)
+                if node <= target:
+                    position = index
+                    target -= node
+            step >>= 1
+        return self.objs[position]
+
+    def exclude(self, obj_id):
+        position = self.positions.get(obj_id)
+        if position is None or position in self.excluded or not self.weights[position]:
+            return
+
+        weight = self.weights[position]
+        self.excluded.add(position)
+        self.total -= weight
+        index = position + 1
+        while index < len(self.tree):
+            self.removed[index] = self.removed.get(index, 0) + weight
+            index += index & -index
+
+
+def pick_asset_block(rotators, rotator_selectors):
+    """Pick one asset per rotator in order (None if a rotator has nothing left), using a
+    selector per distinct rotator. Picked assets are excluded from every rotator."""
+    asset_block = []
+    for rotator in rotators:
+        # Pick a random asset according to its weight
+        asset = rotator_selectors[rotator].pick()
+
+        if asset:
+            # Remove asset from being eligible to play again in this block, even if it's
+            # part of another rotator
+            for selector in rotator_selectors.values():
+                selector.exclude(asset.id)
+
+        asset_block.append(asset)
+
+    return asset_block
+
+
+class EligibilityWindows:
+    """The points in time where any of a set of objects with optional begin and end dates
+    starts or stops airing. Between two points, the same objects are eligible."""
+
+    def __init__(self, objs):
+        self.objs = objs
+        self.points = sorted({obj.begin for obj in objs if obj.begin}
+                             | {obj.end + END_RESOLUTION for obj in objs if obj.end})
+
+    def get_window(self, now):
+        return bisect.bisect_right(self.points, now)
+
+
+class SelectionCache:
+    """Caches selectors per key and eligibility window, dropping everything when the catalog
+    version changes. Selectors are shared between threads, so they're copied before excluding."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.windows = {}
+        self.selectors = {}
+
+    def clear(self):
+        with self.lock:
+            self.version = None
+            self.windows.clear()
+            self.selectors.clear()
+
+    def get_selector(self, key, now, version, get_objs):
+        with self.lock:
+            if version != self.version:
+                self.version = version
+                self.windows.clear()
+                self.selectors.clear()
+
+            windows = self.windows.get(key)
+            if windows is None:
+                windows = self.windows[key] = EligibilityWindows(get_objs())
+
+            window = windows.get_window(now)
+            selector = self.selectors.get((key, window))
+            if selector is None:
+                eligible = [obj for obj in windows.objs if obj.currently_airing(now)]
+                selector = self.selectors[key, window] = WeightedSelector(eligible, (obj.weight for obj in eligible))
+
+        return selector.copy()
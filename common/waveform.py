@@ -0,0 +1,74 @@
+import array
+import base64
+import subprocess
+import sys
+import wave
+
+
+# Rate sox decodes to for finding peaks, plenty for drawing a waveform
+WAVEFORM_SAMPLE_RATE = 8000
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_wav_samples(path):
+    with wave.open(path, 'rb') as wav:
+        while True:
+            frames = wav.readframes(CHUNK_SIZE)
+            if not frames:
+                break
+            yield frames
+
+
+def iter_sox_samples(path):
+    process = subprocess.Popen(
+        ['sox', path, '-t', 'raw', '-e', 'signed-integer', '-b', '16', '-L', '-c', '1', '-',
+         'rate', str(WAVEFORM_SAMPLE_RATE)], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            data = process.stdout.read(CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+    finally:
+        process.stdout.close()
+        process.wait()
+
+
+def get_waveform_peaks(path, peaks_per_second):
+    """Returns base64 encoded int8 (max, min) pairs, peaks_per_second of them per second of audio,
+    to draw a waveform with. 16-bit PCM WAVs are read directly, everything else is decoded by sox."""
+    try:
+        with wave.open(path, 'rb') as wav:
+            is_pcm16 = wav.getsampwidth() == 2
+            samples_per_second = wav.getframerate() * wav.getnchannels()
+    except (wave.Error, EOFError):
+        is_pcm16 = False
+
+    if is_pcm16:
+        chunks = iter_wav_samples(path)
+    else:
+        samples_per_second = WAVEFORM_SAMPLE_RATE
+        chunks = iter_sox_samples(path)
+
+    samples_per_peak = max(1, round(samples_per_second / peaks_per_second))
+    peaks, samples, leftover = array.array('b'), array.array('h'), b''
+
+    for data in chunks:
+        data = leftover + data
+        leftover = data[len(data) & ~1:]
+        chunk = array.array('h', data[:len(data) & ~1])
+        if sys.byteorder == 'big':
+            chunk.byteswap()
+        samples.extend(chunk)
+
+        # Consume whole peaks only, the rest is kept for the next chunk
+        num_samples = len(samples) - len(samples) % samples_per_peak
+        for start in range(0, num_samples, samples_per_peak):
+            peak = samples[start:start + samples_per_peak]
+            peaks.extend((max(peak) >> 8, min(peak) >> 8))
+        del samples[:num_samples]
+
+    if samples:
+        peaks.extend((max(samples) >> 8, min(samples) >> 8))
+
+    return base64.b64encode(peaks.tobytes()).decode('ascii')
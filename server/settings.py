@@ -1,4 +1,5 @@
 from collections import OrderedDict
+import datetime
 import os
 
 import pytz
@@ -79,8 +80,34 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Pre-gzipped export snapshots, on disk so they're shared by all worker processes
+    'export': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'export'),
+        'TIMEOUT': 60 * 60 * 24,
+    },
+    # Verified X-Auth-Token headers, shared by all worker processes so saving a user revokes them everywhere
+    'auth': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'auth'),
+    },
+}
+# Lock files held while building an export snapshot, so only one worker process builds each
+EXPORT_SNAPSHOT_LOCK_ROOT = os.path.join(BASE_DIR, 'cache', 'export-locks')
+
+# How long a verified X-Auth-Token header stays in the auth cache
+AUTH_TOKEN_CACHE_TIMEOUT = 60
+
+# Process-local caches of constance values and the catalog version, for changes made in other processes
+CONFIG_CACHE_TIMEOUT = 30
+CATALOG_VERSION_CACHE_TIMEOUT = 5
+
 # Make sure  MemoryFileUploadHandler isn't set, because of data/models.py:Asset.clean()
-FILE_UPLOAD_HANDLERS = ('django.core.files.uploadhandler.TemporaryFileUploadHandler',)
+FILE_UPLOAD_HANDLERS = ('tomato.uploadhandlers.HashingTemporaryFileUploadHandler',)
 
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'US/Pacific'
@@ -140,12 +167,37 @@ CONSTANCE_CONFIG = OrderedDict({
         'Wait time subtracts the playtime of a stop set in minutes. This will provide more '
         'even results, ie the number of stop sets played per hour will be more consistent at'
         'the expense of a DJs air time.'),
-
-    # 'STRIP_UPLOADED_AUDIO': (True, 'TODO'),
-    # TODO: $ sox in.wav out.wav silence 1 0.1 1% reverse silence 1 0.1 1% reverse
+    'STRIP_UPLOADED_AUDIO': (
+        True,
+        'Strip silence from the beginning and end of audio files uploaded using Bulk Upload, ie '
+        'anything quieter than 1% volume for at least 0.1 seconds. Files are only re-encoded if '
+        'there was silence to trim.'),
 })
 
-# Valid file types as recognized by `soxi -t` and `file --mime-type` minus the audio/[x-]
+# Threads used to probe and trim uploaded audio files (None for Python's default)
+AUDIO_PROCESSING_WORKERS = None
+# Processes used for playout forecasts by each worker (None for one per CPU)
+PLAYOUT_SIMULATION_WORKERS = None
+
+# Resolution of waveforms drawn by clients, as (max, min) pairs per second of audio
+WAVEFORM_PEAKS_PER_SECOND = 10
+
+# Bulk uploads are queued and processed by `manage.py process_uploads`
+UPLOAD_JOB_BATCH_SIZE = 10  # Files probed together per batch
+UPLOAD_JOB_POLL_INTERVAL = 2  # Seconds
+UPLOAD_JOB_STALE_TIMEOUT = datetime.timedelta(minutes=10)  # Before requeuing jobs from a worker that went away
+
+# Playout forecasts requested from the admin are queued and run by `manage.py process_forecasts`
+FORECAST_JOB_POLL_INTERVAL = 2  # Seconds
+FORECAST_JOB_STALE_TIMEOUT = datetime.timedelta(hours=1)  # Before requeuing jobs from a worker that went away
+
+# Log entries older than this are moved out of the database by `manage.py archive_log_entries` (run
+# periodically, eg daily from cron), into gzipped files per month that the admin CSV export still reads
+LOG_ENTRY_RETENTION = datetime.timedelta(days=365)
+LOG_ARCHIVE_ROOT = os.path.join(BASE_DIR, 'archive')
+
+# Valid file types as recognized by `soxi -t` and `file --mime-type` minus the audio/[x-], which
+# common/audio_metadata.py reports the same way
 VALID_AUDIO_FILE_TYPES = {
     '.mp3': {'soxi': 'mp3', 'mime': 'mpeg'},
     '.wav': {'soxi': 'wav', 'mime': 'wav'},
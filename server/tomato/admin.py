@@ -1,25 +1,31 @@
 import csv
 import datetime
+import decimal
 import itertools
+import uuid
 
 from django import forms
 from django.contrib import admin, messages
 from django.contrib.admin.helpers import ActionForm, AdminForm
-from django.contrib.admin.widgets import AdminSplitDateTime
+from django.contrib.admin.widgets import AdminDateWidget, AdminSplitDateTime
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import Group, User
 from django.core.exceptions import PermissionDenied
-from django.db.models import Case, CharField, OuterRef, Q, Subquery, Value, When
-from django.db.models.functions import Coalesce, Concat
-from django.http import HttpResponseRedirect, StreamingHttpResponse
+from django.db import transaction
+from django.db.models import Case, CharField, Count, OuterRef, Prefetch, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Concat, TruncMonth
+from django.http import Http404, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.template.response import TemplateResponse
 from django.urls import path, reverse
 from django.utils import timezone
 from django.utils.html import escape, format_html, mark_safe
 
-from .client_server_constants import COLORS
-from .models import Asset, LogEntry, Rotator, StopSet, StopSetRotator
+from .archive import iter_archived_log_entries
+from .client_server_constants import ACTION_CHOICES, COLORS
+from .models import (currently_enabled_q, next_catalog_version, validate_audio_extension, Asset, ForecastJob,
+                     LogEntry, LogEntryRollup, Rotator, StopSet, StopSetRotator, UploadJob)
+from .simulation import decode_forecast, PROMISE_PERCENTILE
 
 
 STRFTIME_FMT = '%a %b %-d %Y %-I:%M %p'
@@ -80,16 +86,20 @@ class CurrentlyAiringListFilter(admin.SimpleListFilter):
             return queryset.not_currently_airing()
 
 
+def format_duration(duration):
+    if duration is None or duration == datetime.timedelta(seconds=0):
+        return '-'
+    seconds = int(duration.total_seconds())
+    hours, minutes, seconds = seconds // 3600, (seconds // 60) % 60, seconds % 60
+    if hours > 0:
+        return '{}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+    else:
+        return '{}:{:02d}'.format(minutes, seconds)
+
+
 class DurationPrettyMixin:
     def duration_pretty(self, obj):
-        if obj.duration is None or obj.duration == datetime.timedelta(seconds=0):
-            return '-'
-        seconds = int(obj.duration.total_seconds())
-        hours, minutes, seconds = seconds // 3600, (seconds // 60) % 60, seconds % 60
-        if hours > 0:
-            return '{}:{:02d}:{:02d}'.format(hours, minutes, seconds)
-        else:
-            return '{}:{:02d}'.format(minutes, seconds)
+        return format_duration(obj.duration)
     duration_pretty.short_description = 'Duration'
     duration_pretty.admin_order_field = 'duration'
 
@@ -119,13 +129,15 @@ class EnabledDatesRotatorMixin:
     enabled_dates.admin_order_field = Coalesce('begin', 'end')
 
     def enable(self, request, queryset):
-        num = queryset.update(enabled=True)
+        with transaction.atomic():
+            num = queryset.update(enabled=True, version=next_catalog_version())
         if num:
             self.message_user(request, f'Enabled {num} {self.model._meta.verbose_name}(s).', messages.SUCCESS)
     enable.short_description = 'Enable selected %(verbose_name_plural)s'
 
     def disable(self, request, queryset):
-        num = queryset.update(enabled=False)
+        with transaction.atomic():
+            num = queryset.update(enabled=False, version=next_catalog_version())
         if num:
             self.message_user(request, f'Disabled {num} {self.model._meta.verbose_name}(s).', messages.SUCCESS)
     disable.short_description = 'Disable selected %(verbose_name_plural)s'
@@ -133,14 +145,19 @@ class EnabledDatesRotatorMixin:
 
 
 class NumAssetsMixin:
-    def num_assets(self, obj):
-        if isinstance(obj, StopSet):
-            filter_kwargs = {'rotators__in': obj.rotators.all()}
-        else:
-            filter_kwargs = {'rotators': obj}
+    num_assets_lookup = 'assets'
+
+    def get_queryset(self, request):
+        # Counted in one query for all rows, rather than two per row
+        lookup = self.num_assets_lookup
+        return super().get_queryset(request).annotate(
+            num_assets_total=Count(lookup, distinct=True),
+            num_assets_enabled=Count(lookup, filter=currently_enabled_q(prefix=f'{lookup}__'), distinct=True),
+        )
 
-        num_enabled = Asset.objects.filter(**filter_kwargs).currently_enabled().count()
-        num_disabled = Asset.objects.filter(**filter_kwargs).count() - num_enabled
+    def num_assets(self, obj):
+        num_enabled = obj.num_assets_enabled
+        num_disabled = obj.num_assets_total - num_enabled
 
         if num_enabled == num_disabled == 0:
             html = '<em>None</em>'
@@ -151,6 +168,7 @@ class NumAssetsMixin:
                         f'({html} / {num_disabled} Not Currently Airing)</em>')
         return mark_safe(html)
     num_assets.short_description = 'Total Audio Assets'
+    num_assets.admin_order_field = 'num_assets_total'
 
 
 class AssetActionForm(ActionForm):
@@ -167,6 +185,16 @@ class AssetUploadForm(forms.Form):
         label='Rotators', help_text='Optionally select Rotator(s) to add Audio Assets to.')
 
 
+class PlayoutForecastForm(forms.Form):
+    begin = forms.SplitDateTimeField(widget=AdminSplitDateTime(), required=False, label='Begin',
+                                     help_text='Optional date and time to forecast from. Leave blank for now.')
+    days = forms.DecimalField(min_value=decimal.Decimal('0.1'), max_value=31, decimal_places=1, initial=7,
+                              label='Days', help_text='Number of days of playout to forecast.')
+    trials = forms.IntegerField(min_value=1, max_value=1000, initial=100, label='Trials',
+                                help_text='Number of times to simulate playout. More trials give steadier numbers, '
+                                          'but take longer.')
+
+
 class AssetModelAdmin(EnabledDatesRotatorMixin, DurationPrettyMixin, TomatoModelAdmin):
     action_form = AssetActionForm
     actions = ('enable', 'disable', 'add_rotator', 'remove_rotator')
@@ -178,8 +206,14 @@ class AssetModelAdmin(EnabledDatesRotatorMixin, DurationPrettyMixin, TomatoModel
     readonly_fields = ('duration_pretty', 'audio_player', 'rotator_list')
 
     def get_urls(self):
-        return [path('upload/', self.admin_site.admin_view(self.upload_view),
-                name='tomato_asset_upload')] + super().get_urls()
+        return [
+            path('upload/', self.admin_site.admin_view(self.upload_view), name='tomato_asset_upload'),
+            path('upload/<uuid:batch>/', self.admin_site.admin_view(self.upload_progress_view),
+                 name='tomato_asset_upload_progress'),
+            path('forecast/', self.admin_site.admin_view(self.forecast_view), name='tomato_asset_forecast'),
+            path('forecast/<int:job_id>/', self.admin_site.admin_view(self.forecast_result_view),
+                 name='tomato_asset_forecast_result'),
+        ] + super().get_urls()
 
     def upload_view(self, request):
         if not self.has_add_permission(request):
@@ -190,31 +224,33 @@ class AssetModelAdmin(EnabledDatesRotatorMixin, DurationPrettyMixin, TomatoModel
             if form.is_valid():
                 audio_files = request.FILES.getlist('audios')
                 rotators = form.cleaned_data['rotators']
-                assets = []
 
+                # Only check extensions here, files are probed by the process_uploads command
                 for audio in audio_files:
-                    asset = Asset(audio=audio)
-                    assets.append(asset)
-
                     try:
-                        asset.clean()
+                        validate_audio_extension(audio.name)
                     except forms.ValidationError as validation_error:
-                        for field, error_list in validation_error:
-                            for error in error_list:
-                                form.add_error('audios' if field == 'audio' else '__all__', error)
+                        for error in validation_error.messages:
+                            form.add_error('audios', error)
 
             # If no errors where added
             if form.is_valid():
-                for asset in assets:
-                    asset.save()
-
-                    if rotators:
-                        asset.rotators.add(*rotators)
+                batch = uuid.uuid4()
+                through = UploadJob.rotators.through
+                with transaction.atomic():
+                    jobs = []
+                    for audio in audio_files:
+                        job = UploadJob(batch=batch, filename=audio.name,
+                                        audio_hash=getattr(audio, 'audio_hash', ''))
+                        job.audio.save(audio.name, audio)
+                        jobs.append(job)
+                    through.objects.bulk_create(
+                        through(uploadjob_id=job.id, rotator_id=rotator.id) for job in jobs for rotator in rotators)
 
                 self.message_user(
-                    request, f'Uploaded {len(assets)} Audio Assets.', messages.SUCCESS)
+                    request, f'Queued {len(audio_files)} Audio Assets for processing.', messages.SUCCESS)
 
-                return HttpResponseRedirect(reverse('admin:tomato_asset_changelist'))
+                return HttpResponseRedirect(reverse('admin:tomato_asset_upload_progress', args=(batch,)))
         else:
             form = AssetUploadForm()
 
@@ -231,14 +267,77 @@ class AssetModelAdmin(EnabledDatesRotatorMixin, DurationPrettyMixin, TomatoModel
             **self.admin_site.each_context(request),
         })
 
+    def upload_progress_view(self, request, batch):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+
+        jobs = list(UploadJob.objects.filter(batch=batch).select_related('asset'))
+        if not jobs:
+            raise Http404
+
+        num_finished = sum(job.is_finished() for job in jobs)
+        opts = self.model._meta
+        return TemplateResponse(request, 'admin/tomato/asset/upload_progress.html', {
+            'app_label': opts.app_label,
+            'finished': num_finished == len(jobs),
+            'jobs': jobs,
+            'num_failed': sum(job.status == UploadJob.STATUS_FAILED for job in jobs),
+            'num_finished': num_finished,
+            'opts': opts,
+            'title': 'Bulk Upload Progress',
+            **self.admin_site.each_context(request),
+        })
+
+    def forecast_view(self, request):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+
+        if request.method == 'POST':
+            form = PlayoutForecastForm(request.POST)
+            if form.is_valid():
+                # Simulating takes a while, so it's queued for the process_forecasts command
+                begin = form.cleaned_data['begin'] or timezone.now()
+                end = begin + datetime.timedelta(days=float(form.cleaned_data['days']))
+                job = ForecastJob.objects.create(begin=begin, end=end, trials=form.cleaned_data['trials'])
+                return HttpResponseRedirect(reverse('admin:tomato_asset_forecast_result', args=(job.id,)))
+        else:
+            form = PlayoutForecastForm()
+
+        opts = self.model._meta
+        return TemplateResponse(request, 'admin/tomato/asset/forecast.html', {
+            'adminform': AdminForm(form, [(None, {'fields': form.base_fields})], {}),
+            'app_label': opts.app_label,
+            'errors': form.errors.values(),
+            'form': form,
+            'opts': opts,
+            'title': 'Playout Forecast',
+            **self.admin_site.each_context(request),
+        })
+
+    def forecast_result_view(self, request, job_id):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+
+        job = get_object_or_404(ForecastJob, id=job_id)
+        opts = self.model._meta
+        return TemplateResponse(request, 'admin/tomato/asset/forecast_result.html', {
+            'app_label': opts.app_label,
+            'forecast': decode_forecast(job) if job.status == ForecastJob.STATUS_DONE else None,
+            'job': job,
+            'opts': opts,
+            'promise_percentile': PROMISE_PERCENTILE,
+            'title': 'Playout Forecast',
+            **self.admin_site.each_context(request),
+        })
+
     def add_rotator(self, request, queryset):
         rotator_id = request.POST.get('rotator')
         if rotator_id:
             rotator = Rotator.objects.get(id=rotator_id)
-            for asset in queryset:
-                asset.rotators.add(rotator)
+            asset_ids = list(queryset.values_list('id', flat=True))
+            rotator.add_assets(asset_ids)
             self.message_user(
-                request, f'Added {len(queryset)} Audio Asset(s) to {rotator.name}.', messages.SUCCESS)
+                request, f'Added {len(asset_ids)} Audio Asset(s) to {rotator.name}.', messages.SUCCESS)
         else:
             self.message_user(
                 request, 'You must select a Rotator to add Audio Asset(s) to.', messages.WARNING)
@@ -248,10 +347,10 @@ class AssetModelAdmin(EnabledDatesRotatorMixin, DurationPrettyMixin, TomatoModel
         rotator_id = request.POST.get('rotator')
         if rotator_id:
             rotator = Rotator.objects.get(id=rotator_id)
-            for asset in queryset:
-                asset.rotators.remove(rotator)
+            asset_ids = list(queryset.values_list('id', flat=True))
+            rotator.remove_assets(asset_ids)
             self.message_user(
-                request, f'Removed {len(queryset)} Audio Asset(s) from {rotator.name}.', messages.SUCCESS)
+                request, f'Removed {len(asset_ids)} Audio Asset(s) from {rotator.name}.', messages.SUCCESS)
         else:
             self.message_user(
                 request, 'You must select a Rotator to remove Audio Asset(s) from.', messages.WARNING)
@@ -297,11 +396,17 @@ class StopSetRotatorInline(admin.TabularInline):
     verbose_name = 'Rotator Entry'
     verbose_name_plural = 'Rotator Entries'
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_position().select_related('rotator', 'stopset')
+
     def get_formset(self, request, obj, **kwargs):
         formset = super().get_formset(request, obj, **kwargs)
-        widget = formset.form.base_fields['rotator'].widget
+        field = formset.form.base_fields['rotator']
+        widget = field.widget
         widget.can_add_related = False
         widget.can_change_related = False
+        # Same choices for every entry, so query them once rather than once per row
+        field.choices = widget.widget.choices = list(field.choices)
         return formset
 
 
@@ -311,8 +416,12 @@ class GenerateStopSetForm(forms.Form):
 
 class StopSetModelAdmin(EnabledDatesRotatorMixin, NumAssetsMixin, TomatoModelAdmin):
     inlines = (StopSetRotatorInline,)
+    num_assets_lookup = 'rotators__assets'
     list_display = ('name', 'rotator_entry_list', 'enabled_dates', 'enabled',
                     'weight', 'num_assets', 'generate')
+    list_prefetch_related = Prefetch(
+        'stopsetrotator_set', queryset=StopSetRotator.objects.with_position().select_related('rotator'),
+        to_attr='rotator_entries')
     readonly_fields = ('generate',)
 
     def get_urls(self):
@@ -356,12 +465,11 @@ class StopSetModelAdmin(EnabledDatesRotatorMixin, NumAssetsMixin, TomatoModelAdm
         })
 
     def rotator_entry_list(self, obj):
-        rotator_entries = list(StopSetRotator.objects.filter(stopset=obj).order_by(
-            'id').values_list('rotator__name', 'rotator__color'))
+        rotator_entries = obj.rotator_entries
         if rotator_entries:
             html = '<br>'.join(
-                f'<span style="background-color: #{dict(COLORS)[f"{color}-light"]}">{num}. {escape(name)}</span>'
-                for num, (name, color) in enumerate(rotator_entries, 1))
+                f'<span style="background-color: #{dict(COLORS)[f"{entry.rotator.color}-light"]}">'
+                f'{entry.position}. {escape(entry.rotator.name)}</span>' for entry in rotator_entries)
         else:
             html = '<em>None</em>'
         return mark_safe(html)
@@ -407,39 +515,111 @@ class PsuedoCsvBuffer:
         return value
 
 
-class LogEntryAdmin(DurationPrettyMixin, admin.ModelAdmin):
+def user_display_name():
+    # Full name, or whichever of first or last name is set, otherwise username
+    return Case(
+        When(Q(~Q(first_name=''), ~Q(last_name='')), then=Concat('first_name', Value(' '), 'last_name')),
+        When(~Q(first_name=''), then='first_name'),
+        When(~Q(last_name=''), then='last_name'),
+        default='username',
+        output_field=CharField(),
+    )
+
+
+class LogEntryExportForm(forms.Form):
+    begin = forms.DateField(widget=AdminDateWidget(), required=False, label='From Date',
+                            help_text='Optionally export entries on or after this date.')
+    end = forms.DateField(widget=AdminDateWidget(), required=False, label='To Date',
+                          help_text='Optionally export entries on or before this date.')
+    actions = forms.MultipleChoiceField(choices=ACTION_CHOICES, required=False, widget=forms.CheckboxSelectMultiple(),
+                                        label='Actions', help_text='Optionally export only these actions.')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        begin, end = cleaned_data.get('begin'), cleaned_data.get('end')
+        if begin and end and begin > end:
+            raise forms.ValidationError('From Date must be before To Date.')
+        return cleaned_data
+
+    def get_datetime_range(self):
+        # [begin, end) as datetimes, from the start of the first day to the start of the day after the last
+        tz = timezone.get_current_timezone()
+        begin, end = self.cleaned_data['begin'], self.cleaned_data['end']
+        if begin:
+            begin = tz.localize(datetime.datetime.combine(begin, datetime.time()))
+        if end:
+            end = tz.localize(datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time()))
+        return begin, end
+
+    def filter(self, queryset):
+        begin, end = self.get_datetime_range()
+        actions = self.cleaned_data['actions']
+
+        if begin:
+            queryset = queryset.filter(created__gte=begin)
+        if end:
+            queryset = queryset.filter(created__lt=end)
+        if actions:
+            queryset = queryset.filter(action__in=actions)
+        return queryset
+
+    def filter_days(self, queryset):
+        begin, end, actions = (self.cleaned_data[field] for field in ('begin', 'end', 'actions'))
+
+        if begin:
+            queryset = queryset.filter(day__gte=begin)
+        if end:
+            queryset = queryset.filter(day__lte=end)
+        if actions:
+            queryset = queryset.filter(action__in=actions)
+        return queryset
+
+
+class LogReportAdminMixin:
     empty_value_display = 'N/A'
+    export_filename = None
+    export_header = None
     list_filter = ('action',)
-    list_max_show_all = 5000
-    list_per_page = 250
     save_on_top = True
-    # TODO: summary totals at bottom of page via overriding of
-    # change_list_results.html
 
     def get_urls(self):
         return [path('export/', self.admin_site.admin_view(self.export_view),
-                name='tomato_logentry_export')] + super().get_urls()
+                name=f'tomato_{self.model._meta.model_name}_export')] + super().get_urls()
 
     def export_view(self, request):
         if not (self.has_add_permission(request) or self.has_view_permission(request)):
             raise PermissionDenied
 
-        qs = self.get_queryset(request).values_list('created', 'action', 'user', 'duration', 'description')
-        tz = timezone.get_current_timezone()
+        form = LogEntryExportForm(request.GET or None)
+        if form.is_valid():
+            return self.export_csv(form)
 
-        rows = itertools.chain(
-            [['Date', 'Action', 'User', 'Duration (if any)', 'Description (if any)']],
-            ([str(tz.normalize(created)), action, user.split(':', 1)[1] if user else None, dur, desc]
-             for created, action, user, dur, desc in qs),
-        )
+        opts = self.model._meta
+        return TemplateResponse(request, 'admin/tomato/logentry/export.html', {
+            'adminform': AdminForm(form, [(None, {'fields': form.base_fields})], {}),
+            'app_label': opts.app_label,
+            'errors': form.errors.values(),
+            'form': form,
+            'opts': opts,
+            'title': f'Export {opts.verbose_name_plural} as CSV',
+            **self.admin_site.each_context(request),
+        })
 
+    def export_csv(self, form):
+        return self.stream_csv(self.export_header, self.get_export_rows(form))
+
+    def stream_csv(self, header, rows):
         csv_writer = csv.writer(PsuedoCsvBuffer())
-        response = StreamingHttpResponse((csv_writer.writerow(row) for row in rows), content_type='text/csv')
-        now_str = tz.normalize(timezone.now()).strftime('%Y%m%d%H%M%S')
-        response['Content-Disposition'] = f'attachment; filename="tomato_log_export-{now_str}.csv"'
+        response = StreamingHttpResponse((csv_writer.writerow(row) for row in itertools.chain([header], rows)),
+                                         content_type='text/csv')
+        now_str = timezone.localtime().strftime('%Y%m%d%H%M%S')
+        response['Content-Disposition'] = f'attachment; filename="{self.export_filename}-{now_str}.csv"'
 
         return response
 
+    def get_user_names(self):
+        return dict(User.objects.annotate(name=user_display_name()).values_list('id', 'name'))
+
     def username_with_link(self, obj):
         if obj and obj.user:
             user_id, name = obj.user.split(':', 1)
@@ -456,23 +636,15 @@ class LogEntryAdmin(DurationPrettyMixin, admin.ModelAdmin):
             return mark_safe('<em>unknown</em>')
     username.short_description = username_with_link.short_description = 'Username'
 
-    def get_fields(self, request, obj=None):
+    def get_username_field(self, request):
         has_user_perm = request.user.has_perm('auth.change_user') or request.user.has_perm('auth.view_user')
-        return ('created', 'action', 'username_with_link' if has_user_perm else 'username',
-                'duration_pretty', 'description')
-    get_list_display = get_fields
+        return 'username_with_link' if has_user_perm else 'username'
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
         return qs.annotate(user=Subquery(User.objects.annotate(
-            user=Case(
-                When(Q(~Q(first_name=''), ~Q(last_name='')),
-                     then=Concat('id', Value(':'), 'first_name', Value(' '), 'last_name')),
-                When(~Q(first_name=''), then=Concat('id', Value(':'), 'first_name')),
-                When(~Q(last_name=''), then=Concat('id', Value(':'), 'last_name')),
-                default=Concat('id', Value(':'), 'username'),
-                output_field=CharField(),
-            )).values('user').filter(id=OuterRef('user_id'))))
+            user=Concat('id', Value(':'), user_display_name(), output_field=CharField()),
+        ).values('user').filter(id=OuterRef('user_id'))))
 
     def has_add_permission(self, request):
         return False
@@ -484,10 +656,68 @@ class LogEntryAdmin(DurationPrettyMixin, admin.ModelAdmin):
         return False
 
 
+class LogEntryAdmin(LogReportAdminMixin, DurationPrettyMixin, admin.ModelAdmin):
+    export_chunk_size = 2000
+    export_filename = 'tomato_log_export'
+    export_header = ('Date', 'Action', 'User', 'Duration (if any)', 'Description (if any)')
+    list_max_show_all = 5000
+    list_per_page = 250
+
+    def get_export_rows(self, form):
+        # Users are looked up once up front, and entries fetched in chunks with a server-side
+        # cursor (where supported), so memory use doesn't depend on the number of entries. Archived
+        # entries are older, so they follow the ones still in the database.
+        users = self.get_user_names()
+        entries = itertools.chain(
+            form.filter(LogEntry.objects.all()).values_list(
+                'created', 'action', 'user_id', 'duration', 'description').iterator(chunk_size=self.export_chunk_size),
+            iter_archived_log_entries(*form.get_datetime_range(), actions=form.cleaned_data['actions']),
+        )
+
+        return ([str(timezone.localtime(created)), action, users.get(user_id), dur, desc]
+                for created, action, user_id, dur, desc in entries)
+
+    def get_fields(self, request, obj=None):
+        return ('created', 'action', self.get_username_field(request), 'duration_pretty', 'description')
+    get_list_display = get_fields
+
+
+class LogEntryRollupAdmin(LogReportAdminMixin, DurationPrettyMixin, admin.ModelAdmin):
+    date_hierarchy = 'day'
+    export_filename = 'tomato_log_totals_export'
+    export_header = ('Month', 'Action', 'User', 'Description (if any)', 'Count', 'Total Duration')
+    list_max_show_all = 5000
+    list_per_page = 250
+
+    def get_export_rows(self, form):
+        # Monthly totals, summed from the rollups rather than counted from individual entries
+        users = self.get_user_names()
+        totals = form.filter_days(LogEntryRollup.objects.all()).annotate(month=TruncMonth('day')).values_list(
+            'month', 'action', 'user_id', 'description').annotate(
+            total_count=Sum('count'), total_duration=Sum('duration')).order_by('-month', 'action', 'description')
+
+        return ([month.strftime('%Y-%m'), action, users.get(user_id), desc, count, duration]
+                for month, action, user_id, desc, count, duration in totals)
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        if hasattr(response, 'context_data') and 'cl' in response.context_data:
+            # Summed over all matching rollups, not just the current page
+            totals = response.context_data['cl'].queryset.aggregate(count=Sum('count'), duration=Sum('duration'))
+            response.context_data['totals'] = {'count': totals['count'] or 0,
+                                               'duration': format_duration(totals['duration'])}
+        return response
+
+    def get_fields(self, request, obj=None):
+        return ('day', 'action', self.get_username_field(request), 'description', 'count', 'duration_pretty')
+    get_list_display = get_fields
+
+
 admin.site.unregister(User)
 admin.site.unregister(Group)
 admin.site.register(User, TomatoUserAdmin)
 admin.site.register(Asset, AssetModelAdmin)
 admin.site.register(LogEntry, LogEntryAdmin)
+admin.site.register(LogEntryRollup, LogEntryRollupAdmin)
 admin.site.register(Rotator, RotatorModelAdmin)
 admin.site.register(StopSet, StopSetModelAdmin)
@@ -1,5 +1,7 @@
 from django.apps import AppConfig
 from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError
+from django.db.models.signals import post_migrate
 
 try:
     import sox  # noqa
@@ -10,6 +12,7 @@ except ImportError:
 class TomatoConfig(AppConfig):
     name = 'tomato'
     verbose_name = 'Radio Automation'
+    latest_migration = None
 
     def ready(self):
         from constance.apps import ConstanceConfig
@@ -18,3 +21,18 @@ class TomatoConfig(AppConfig):
 
         # Create permission here, re:
         # - https://github.com/jazzband/django-constance/blob/master/constance/apps.py
+
+        from . import signals  # noqa
+
+        # Only changes on deploy, so ping doesn't need to query for it
+        self.load_latest_migration()
+        post_migrate.connect(self.load_latest_migration, sender=self)
+
+    def load_latest_migration(self, **kwargs):
+        from .models import get_latest_tomato_migration
+
+        try:
+            self.latest_migration = get_latest_tomato_migration()
+        except DatabaseError:
+            # Database not yet created or reachable, post_migrate will get it
+            pass
@@ -0,0 +1,103 @@
+import datetime
+import glob
+import gzip
+import json
+import os
+
+from django.conf import settings
+from django.db.models.functions import TruncMonth
+
+from .export import json_dumps
+from .models import LogEntry
+
+
+ARCHIVE_CHUNK_SIZE = 2000
+ARCHIVE_FIELDS = ('uuid', 'created', 'user_id', 'action', 'duration', 'description')
+ARCHIVE_FILENAME_PREFIX = 'log_entries-'
+ARCHIVE_FILENAME_SUFFIX = '.jsonl.gz'
+
+
+def get_archive_path(month):
+    return os.path.join(settings.LOG_ARCHIVE_ROOT, f'{ARCHIVE_FILENAME_PREFIX}{month:%Y-%m}{ARCHIVE_FILENAME_SUFFIX}')
+
+
+def get_next_month(month):
+    return (month + datetime.timedelta(days=32)).replace(day=1)
+
+
+def parse_archived_row(line):
+    row = json.loads(line)
+    return {name: LogEntry._meta.get_field(name).to_python(row[name]) for name in ARCHIVE_FIELDS}
+
+
+def iter_archive_lines(path):
+    if os.path.exists(path):
+        with gzip.open(path, 'rt', encoding='utf8') as file:
+            yield from file
+
+
+def archive_month(month, entries):
+    # Rewrite the month's file with existing and new rows, newest first like the admin, and only
+    # delete rows once the file is in place. Rows already in the file (from an interrupted run)
+    # aren't written twice.
+    path = get_archive_path(month)
+    rows = {}
+    for line in iter_archive_lines(path):
+        row = parse_archived_row(line)
+        rows[row['uuid']] = (row['created'], line.rstrip('\n'))
+
+    archived_ids = []
+    for entry in entries.values('id', *ARCHIVE_FIELDS).iterator(chunk_size=ARCHIVE_CHUNK_SIZE):
+        archived_ids.append(entry.pop('id'))
+        rows.setdefault(entry['uuid'], (entry['created'], json_dumps(entry)))
+
+    if not archived_ids:
+        return 0
+
+    with gzip.open(f'{path}.tmp', 'wt', encoding='utf8') as file:
+        for _, line in sorted(rows.values(), key=lambda row: row[0], reverse=True):
+            file.write(f'{line}\n')
+    os.replace(f'{path}.tmp', path)
+
+    # By id, so entries pushed for this month since they were read aren't deleted unarchived
+    for offset in range(0, len(archived_ids), ARCHIVE_CHUNK_SIZE):
+        LogEntry.objects.filter(id__in=archived_ids[offset:offset + ARCHIVE_CHUNK_SIZE]).delete()
+
+    return len(archived_ids)
+
+
+def archive_log_entries(before):
+    """Move log entries created before a datetime out of the database, into one gzipped JSON lines
+    file per month (in UTC) under LOG_ARCHIVE_ROOT. Returns the number of entries archived."""
+    os.makedirs(settings.LOG_ARCHIVE_ROOT, exist_ok=True)
+    entries = LogEntry.objects.filter(created__lt=before)
+    months = entries.annotate(month=TruncMonth('created', tzinfo=datetime.timezone.utc)).values_list(
+        'month', flat=True).distinct().order_by('month')
+
+    num_archived = 0
+    for month in months:
+        num_archived += archive_month(month, entries.filter(created__gte=month, created__lt=get_next_month(month)))
+    return num_archived
+
+
+def iter_archived_log_entries(begin=None, end=None, actions=()):
+    """Yield (created, action, user_id, duration, description) of archived log entries, newest first,
+    created in [begin, end) and with one of actions, if given"""
+    paths = sorted(glob.glob(os.path.join(
+        settings.LOG_ARCHIVE_ROOT, f'{ARCHIVE_FILENAME_PREFIX}*{ARCHIVE_FILENAME_SUFFIX}')), reverse=True)
+
+    for path in paths:
+        month = datetime.datetime.strptime(
+            os.path.basename(path)[len(ARCHIVE_FILENAME_PREFIX):-len(ARCHIVE_FILENAME_SUFFIX)], '%Y-%m',
+        ).replace(tzinfo=datetime.timezone.utc)
+        # Skip whole files outside of the date range without opening them
+        if (end and month >= end) or (begin and get_next_month(month) <= begin):
+            continue
+
+        for line in iter_archive_lines(path):
+            row = parse_archived_row(line)
+            if (begin and row['created'] < begin) or (end and row['created'] >= end):
+                continue
+            if actions and row['action'] not in actions:
+                continue
+            yield row['created'], row['action'], row['user_id'], row['duration'], row['description']
@@ -0,0 +1 @@
+../../common/audio_metadata.py
\ No newline at end of file
@@ -0,0 +1,112 @@
+from collections import OrderedDict
+import functools
+import threading
+import time
+
+import pytz
+
+from django.conf import settings
+
+from constance import settings as constance_settings
+from constance.utils import import_module_attr
+
+from .client_server_constants import CLIENT_CONFIG_KEYS
+from .models import get_catalog_version
+
+
+class LocalTTLCache:
+    """Thread-safe, process-local LRU cache with entries that expire after timeout seconds"""
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_matching(self, predicate):
+        with self._lock:
+            for key in [key for key, (_, value) in self._data.items() if predicate(value)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+config_cache = LocalTTLCache(max_size=100, timeout=settings.CONFIG_CACHE_TIMEOUT)
+
+
+@functools.lru_cache()
+def get_constance_backend():
+    # Our own instance of the configured backend, since constance.config doesn't expose its mget()
+    return import_module_attr(constance_settings.BACKEND)()
+
+
+def load_config(keys):
+    # Like getattr(config, key) for each key, but in one query
+    values = {key: constance_settings.CONFIG[key][0] for key in keys}
+    values.update(get_constance_backend().mget(keys))
+    return values
+
+
+def get_config(key):
+    # Cached for CONFIG_CACHE_TIMEOUT seconds or until constance is updated in this process
+    values = config_cache.get('values')
+    if values is None:
+        values = load_config(constance_settings.CONFIG)
+        config_cache.set('values', values)
+    return values[key]
+
+
+def get_client_config(catalog_version):
+    # Changing client config bumps the catalog version, so keying on it means clients never get
+    # a new version with stale config changed in another process
+    key = ('client', catalog_version)
+    client_config = config_cache.get(key)
+    if client_config is None:
+        values = load_config([key.upper() for key in CLIENT_CONFIG_KEYS])
+        client_config = {key: values[key.upper()] for key in CLIENT_CONFIG_KEYS}
+        config_cache.set(key, client_config)
+    return client_config
+
+
+catalog_version_cache = LocalTTLCache(max_size=1, timeout=settings.CATALOG_VERSION_CACHE_TIMEOUT)
+
+
+def get_cached_catalog_version():
+    # For ping, where a few seconds stale is fine. Use get_catalog_version() when it's not.
+    version = catalog_version_cache.get('version')
+    if version is None:
+        version = get_catalog_version()
+        catalog_version_cache.set('version', version)
+    return version
+
+
+@functools.lru_cache()
+def get_timezone(name):
+    return pytz.timezone(name)
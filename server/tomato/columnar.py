@@ -0,0 +1 @@
+../../common/columnar.py
\ No newline at end of file
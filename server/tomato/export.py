@@ -0,0 +1,157 @@
+from collections import defaultdict
+import fcntl
+import glob
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.serializers.python import Serializer as PythonSerializer
+
+from .columnar import encode_block, get_fields, get_lookups
+
+
+EXPORT_CHUNK_SIZE = 500
+# How long to wait for another process building a snapshot before streaming the export instead
+EXPORT_SNAPSHOT_WAIT_TIMEOUT = 30
+EXPORT_SNAPSHOT_WAIT_INTERVAL = 0.1
+
+
+def json_dumps(obj):
+    return json.dumps(obj, cls=DjangoJSONEncoder)
+
+
+def get_m2m_pks(queryset):
+    # Map {field: {pk: [related pks, ...]}} for each auto-created many-to-many field of the
+    # queryset's model, using one query per field on the through table rather than one per object
+    m2m_pks = {}
+    for field in queryset.model._meta.many_to_many:
+        through = field.remote_field.through
+        if field.serialize and through._meta.auto_created:
+            source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+            # Same order the related manager would return, ie per the related model's ordering
+            ordering = [f'{target}__{order}' for order in field.related_model._meta.ordering] + ['pk']
+
+            pks = m2m_pks[field] = defaultdict(list)
+            for pk, related_pk in through.objects.filter(**{f'{source}__in': queryset.values('pk')}).order_by(
+                    *ordering).values_list(f'{source}_id', f'{target}_id').iterator():
+                pks[pk].append(related_pk)
+    return m2m_pks
+
+
+class ExportSerializer(PythonSerializer):
+    def __init__(self, m2m_pks):
+        super().__init__()
+        self.m2m_pks = m2m_pks
+
+    def handle_m2m_field(self, obj, field):
+        if field in self.m2m_pks:
+            self._current[field.name] = self.m2m_pks[field].get(obj.pk, [])
+        else:
+            super().handle_m2m_field(obj, field)
+
+
+def iter_export_json(data, querysets, chunk_size=EXPORT_CHUNK_SIZE):
+    # Output is identical to JsonResponse({**data, 'objects': serialize('python', ...)}), but
+    # written out chunk by chunk so the whole catalog is never in memory at once
+    yield f'{json_dumps(data)[:-1]}, "objects": ['
+
+    separator = ''
+    for queryset in querysets:
+        serializer = ExportSerializer(get_m2m_pks(queryset))
+        objects = queryset.iterator(chunk_size=chunk_size)
+        while True:
+            chunk = list(itertools.islice(objects, chunk_size))
+            if not chunk:
+                break
+
+            yield separator + ', '.join(json_dumps(obj) for obj in serializer.serialize(chunk))
+            separator = ', '
+
+    yield ']}'
+
+
+def iter_columnar_json(data, querysets, chunk_size=EXPORT_CHUNK_SIZE):
+    # Each table is sent as blocks of columns, one per chunk of rows, so like iter_export_json()
+    # the whole catalog is never in memory at once
+    yield f'{json_dumps(data)[:-1]}, "tables": {{'
+
+    separator = ''
+    for queryset in querysets:
+        model = queryset.model
+        lookups, m2m_pks = get_lookups(model), get_m2m_pks(queryset)
+        yield f'{separator}{json_dumps(model._meta.label_lower)}: {{"lookups": {json_dumps(lookups)}, "blocks": ['
+        separator = ', '
+
+        rows = queryset.values_list(*(field.attname for field in get_fields(model))).iterator(chunk_size=chunk_size)
+        block_separator = ''
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+
+            yield block_separator + json_dumps(encode_block(chunk, model, lookups, m2m_pks))
+            block_separator = ', '
+
+        yield ']}'
+
+    yield '}}'
+
+
+def gzip_chunks(chunks):
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as file:
+        for chunk in chunks:
+            file.write(chunk.encode('utf8'))
+    return buffer.getvalue()
+
+
+def get_export_snapshot(data, iter_chunks):
+    """Return gzipped iter_chunks() for a full export of data, building it if needed, or None
+    if another process took longer than EXPORT_SNAPSHOT_WAIT_TIMEOUT to build it"""
+    cache = caches['export']
+    data_hash = hashlib.md5(json_dumps(data).encode('utf8')).hexdigest()
+    key = f'export:{data["version"]}:{data_hash}'
+
+    snapshot = cache.get(key)
+    if snapshot is None:
+        # Only one process builds a given snapshot, and the rest wait to serve it rather than all
+        # serializing the catalog at once. The lock is released when the file is closed, so one
+        # left by a crashed process never gets stuck.
+        os.makedirs(settings.EXPORT_SNAPSHOT_LOCK_ROOT, exist_ok=True)
+        with open(os.path.join(settings.EXPORT_SNAPSHOT_LOCK_ROOT, f'{data_hash}.lock'), 'w') as lock_file:
+            deadline = time.monotonic() + EXPORT_SNAPSHOT_WAIT_TIMEOUT
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        return None
+                    time.sleep(EXPORT_SNAPSHOT_WAIT_INTERVAL)
+
+            # Whoever held the lock has most likely just built it
+            snapshot = cache.get(key)
+            if snapshot is None:
+                snapshot = gzip_chunks(iter_chunks())
+                cache.set(key, snapshot)
+
+    return snapshot
+
+
+def clear_export_snapshots():
+    caches['export'].clear()
+    # Remove lock files too, except any being held for a build in progress
+    for path in glob.glob(os.path.join(settings.EXPORT_SNAPSHOT_LOCK_ROOT, '*.lock')):
+        try:
+            with open(path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,22 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tomato.archive import archive_log_entries
+
+
+class Command(BaseCommand):
+    help = 'Move old client log entries out of the database into compressed monthly archive files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help=(
+            'Archive entries older than this many days. (Defaults to LOG_ENTRY_RETENTION, '
+            f'{settings.LOG_ENTRY_RETENTION.days} days.)'))
+
+    def handle(self, *args, days=None, **options):
+        retention = settings.LOG_ENTRY_RETENTION if days is None else datetime.timedelta(days=days)
+        num_archived = archive_log_entries(timezone.now() - retention)
+        self.stdout.write(f'Archived {num_archived} log entr{"y" if num_archived == 1 else "ies"} '
+                          f'to {settings.LOG_ARCHIVE_ROOT}')
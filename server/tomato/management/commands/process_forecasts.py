@@ -0,0 +1,44 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection, OperationalError
+
+from tomato.models import ForecastJob
+from tomato.simulation import encode_forecast, simulate_playout
+
+
+class Command(BaseCommand):
+    help = 'Run playout forecasts queued by the admin'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when there are no more queued forecasts.')
+
+    def handle(self, *args, once=False, **options):
+        while True:
+            # Like Django does around each request, so a long-running worker drops broken or expired connections
+            close_old_connections()
+            try:
+                jobs = ForecastJob.claim(1, settings.FORECAST_JOB_STALE_TIMEOUT)
+                if jobs:
+                    self.process_job(jobs[0])
+            except OperationalError as e:
+                # A claimed job is retried once it's stale, and the next claim gets a new connection
+                self.stderr.write(f'Database error: {e}')
+                connection.close()
+            else:
+                if jobs:
+                    continue
+                elif once:
+                    break
+            time.sleep(settings.FORECAST_JOB_POLL_INTERVAL)
+
+    def process_job(self, job):
+        try:
+            forecast = simulate_playout(job.begin, job.end, job.trials)
+        except Exception as e:
+            job.finish(errors=[f'Error forecasting playout: {e}'])
+        else:
+            job.finish(encode_forecast(forecast))
+
+        self.stdout.write(f'{job.get_status_display()}: {job}')
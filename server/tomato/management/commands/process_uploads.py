@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection, OperationalError, transaction
+from django.db.models import prefetch_related_objects
+
+from tomato.cache import get_config
+from tomato.models import Asset, UploadJob
+
+
+class Command(BaseCommand):
+    help = 'Process audio files queued by the bulk upload admin page'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when there are no more queued uploads.')
+
+    def handle(self, *args, once=False, **options):
+        while True:
+            # Like Django does around each request, so a long-running worker drops broken or expired connections
+            close_old_connections()
+            try:
+                jobs = UploadJob.claim(settings.UPLOAD_JOB_BATCH_SIZE, settings.UPLOAD_JOB_STALE_TIMEOUT)
+                if jobs:
+                    self.process_jobs(jobs)
+            except OperationalError as e:
+                # Claimed jobs are retried once they're stale, and the next claim gets a new connection
+                self.stderr.write(f'Database error: {e}')
+                connection.close()
+            else:
+                if jobs:
+                    continue
+                elif once:
+                    break
+            time.sleep(settings.UPLOAD_JOB_POLL_INTERVAL)
+
+    def trim_jobs_audio(self, jobs):
+        # Jobs being retried may have been trimmed already
+        jobs = [job for job in jobs if not job.trimmed]
+
+        # Trimming is spent in sox subprocesses, so threads are enough to spread it across cores
+        with ThreadPoolExecutor(max_workers=settings.AUDIO_PROCESSING_WORKERS) as executor:
+            for error in executor.map(UploadJob.trim_audio, jobs):
+                if error:
+                    self.stderr.write(error)
+
+        UploadJob.objects.bulk_update([job for job in jobs if job.trimmed], ('audio_hash', 'trimmed'))
+
+    def process_jobs(self, jobs):
+        # Trim first, so the probe gets the final duration, hash, and peaks
+        if get_config('STRIP_UPLOADED_AUDIO'):
+            self.trim_jobs_audio(jobs)
+
+        # A staged file that's gone missing or can't be read only fails its own job
+        assets = {}
+        for job in jobs:
+            try:
+                assets[job.id] = job.get_asset()
+            except Exception as e:
+                self.fail_job(job, e)
+        Asset.probe_audio_files(assets.values())
+        prefetch_related_objects(jobs, 'rotators')
+        through = Asset.rotators.through
+
+        for job in jobs:
+            asset = assets.get(job.id)
+            if asset is None:
+                continue
+
+            try:
+                asset.clean()
+                with transaction.atomic():
+                    asset.save()
+                    # The asset is new, so no existing rows to check for, and its version was just
+                    # set on save, so no need for m2m_changed to set it again
+                    through.objects.bulk_create(
+                        through(asset_id=asset.id, rotator_id=rotator.id) for rotator in job.rotators.all())
+                    job.finish(asset)
+            except ValidationError as validation_error:
+                job.finish(errors=validation_error.messages)
+            except Exception as e:
+                self.fail_job(job, e)
+                continue
+            finally:
+                asset.audio.file.close()
+
+            self.stdout.write(f'{job.get_status_display()}: {job.filename}')
+
+    def fail_job(self, job, error):
+        job.finish(errors=[f"Error processing '{job.filename}': {error}"])
+        self.stdout.write(f'{job.get_status_display()}: {job.filename}')
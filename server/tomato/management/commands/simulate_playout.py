@@ -0,0 +1,63 @@
+import csv
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from tomato.simulation import simulate_playout, PROMISE_PERCENTILE
+
+
+class Command(BaseCommand):
+    help = 'Forecast plays and airtime per audio asset and rotator by simulating client playout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--begin', help='Date and time to start playout at, eg 2020-03-14T00:00 (default: now)')
+        parser.add_argument('--days', type=float, default=7, help='Days of playout to simulate (default: 7)')
+        parser.add_argument('--hours', type=float, help='Hours of playout to simulate, instead of --days')
+        parser.add_argument('--trials', type=int, default=100, help='Number of times to simulate (default: 100)')
+        parser.add_argument('--seed', type=int, help='Random seed, for repeatable forecasts')
+        parser.add_argument('--workers', type=int, help='Processes to use (default: PLAYOUT_SIMULATION_WORKERS)')
+        parser.add_argument('--csv', action='store_true', help='Output assets and rotators as CSV')
+
+    def handle(self, *args, begin=None, days=7, hours=None, trials=100, seed=None, workers=None, **options):
+        if begin is None:
+            begin = timezone.now()
+        else:
+            try:
+                begin = parse_datetime(begin)
+            except ValueError:
+                begin = None
+            if begin is None:
+                raise CommandError('Invalid --begin, expected a date and time like 2020-03-14T00:00')
+            if timezone.is_naive(begin):
+                begin = timezone.make_aware(begin)
+        if trials < 1:
+            raise CommandError('--trials must be at least 1')
+
+        end = begin + (datetime.timedelta(hours=hours) if hours is not None else datetime.timedelta(days=days))
+        forecast = simulate_playout(begin, end, trials, seed=seed, workers=workers)
+
+        if options['csv']:
+            self.write_csv(forecast)
+        else:
+            self.write_table(forecast)
+
+    def write_csv(self, forecast):
+        writer = csv.writer(self.stdout)
+        writer.writerow(['Type', 'Name', 'Mean Plays', f'Plays in {PROMISE_PERCENTILE}% of Trials', 'Mean Airtime'])
+        for kind, rows in (('rotator', forecast.rotators), ('asset', forecast.assets)):
+            for row in rows:
+                writer.writerow([kind, row.name, f'{row.plays:.1f}', row.promised_plays, row.airtime])
+
+    def write_table(self, forecast):
+        self.stdout.write(f'Forecast from {timezone.localtime(forecast.begin)} to {timezone.localtime(forecast.end)} '
+                          f'over {forecast.trials} trials. Promised plays are reached by {PROMISE_PERCENTILE}% '
+                          'of trials.\n')
+        for title, rows in (('Rotators', forecast.rotators), ('Audio Assets', forecast.assets)):
+            width = max([len(row.name) for row in rows] + [len(title)])
+            self.stdout.write(f'{title:<{width}}  {"Mean Plays":>10}  {"Promised":>8}  {"Mean Airtime":>12}')
+            for row in rows:
+                self.stdout.write(f'{row.name:<{width}}  {row.plays:>10.1f}  {row.promised_plays:>8}  '
+                                  f'{str(row.airtime):>12}')
+            self.stdout.write('')
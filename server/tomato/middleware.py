@@ -1,12 +1,51 @@
 import hashlib
+import uuid
 
 import pytz
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core import signing
+from django.core.cache import caches
 from django.utils import timezone
 
-from constance import config
+from .cache import get_config, get_timezone
+
+
+def clear_user_auth_tokens(user_id):
+    # Password or active flag may have changed, so the user's tokens need to be verified again.
+    # A new version in the shared cache invalidates their cached tokens in every process.
+    caches['auth'].set(f'auth_version:{user_id}', uuid.uuid4().hex, timeout=None)
+
+
+def get_user_from_token(token):
+    try:
+        payload = signing.loads(token)
+    except signing.BadSignature:
+        return None
+
+    # Verified tokens => (user's auth version, user), shared by all worker processes
+    auth_cache = caches['auth']
+    token_key = 'auth_token:' + hashlib.sha256(token.encode('utf8')).hexdigest()
+    version_key = f'auth_version:{payload["user_id"]}'
+    cached = auth_cache.get_many([token_key, version_key])
+    version = cached.get(version_key)
+    if version is None:
+        auth_cache.add(version_key, uuid.uuid4().hex, timeout=None)
+        version = auth_cache.get(version_key)
+    elif token_key in cached and cached[token_key][0] == version:
+        return cached[token_key][1]
+
+    try:
+        user = User.objects.get(id=payload['user_id'], is_active=True)
+    except User.DoesNotExist:
+        pass
+    else:
+        pw_hash = hashlib.md5(user.password.encode('utf8')).hexdigest()
+        if payload['pw_hash'] == pw_hash:
+            # Version was read before the user, so a concurrent save makes this entry unusable, not wrong
+            auth_cache.set(token_key, (version, user), settings.AUTH_TOKEN_CACHE_TIMEOUT)
+            return user
 
 
 class ServerMiddleware:
@@ -18,24 +57,14 @@ class ServerMiddleware:
 
         token = request.headers.get('X-Auth-Token') or request.GET.get('auth_token')
         if token:
-            try:
-                payload = signing.loads(token)
-            except signing.BadSignature:
-                pass
-            else:
-                try:
-                    user = User.objects.get(id=payload['user_id'])
-                except User.DoesNotExist:
-                    pass
-                else:
-                    pw_hash = hashlib.md5(user.password.encode('utf8')).hexdigest()
-                    if payload['pw_hash'] == pw_hash:
-                        request.valid_token = True
-                        request.user = user
+            user = get_user_from_token(token)
+            if user is not None:
+                request.valid_token = True
+                request.user = user
 
     def set_timezone(self, request):
         try:
-            tz = pytz.timezone(config.TIMEZONE)
+            tz = get_timezone(get_config('TIMEZONE'))
         except pytz.UnknownTimeZoneError:
             pass
         else:
@@ -0,0 +1,105 @@
+import threading
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from constance import settings as constance_settings
+from constance.signals import config_updated
+
+from .cache import catalog_version_cache, config_cache
+from .client_server_constants import CLIENT_CONFIG_KEYS
+from .export import clear_export_snapshots
+from .middleware import clear_user_auth_tokens
+from .models import next_catalog_version, Asset, LogEntry, LogEntryRollup, Rotator, StopSet, StopSetRotator, Tombstone
+
+
+CATALOG_MODELS = (Asset, Rotator, StopSet, StopSetRotator)
+
+# Token shared by the changes in the current transaction, so caches are cleared once when it commits
+pending_catalog_changes = threading.local()
+
+
+def catalog_committed(token):
+    # Every change registers this, but only the first to run after a commit clears. Callbacks are
+    # dropped when a transaction rolls back, so its token just carries over to the next one.
+    if getattr(pending_catalog_changes, 'token', None) is token:
+        pending_catalog_changes.token = None
+        catalog_version_cache.clear()
+        # Snapshots are keyed by version anyway, but this gets stale ones off disk
+        clear_export_snapshots()
+
+
+def catalog_changed():
+    token = getattr(pending_catalog_changes, 'token', None)
+    if token is None:
+        token = pending_catalog_changes.token = object()
+    transaction.on_commit(lambda: catalog_committed(token))
+    return next_catalog_version()
+
+
+def set_catalog_version(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance.version = catalog_changed()
+
+
+def create_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(model=sender._meta.label_lower, object_id=instance.pk,
+                             version=catalog_changed())
+
+
+for model in CATALOG_MODELS:
+    pre_save.connect(set_catalog_version, sender=model)
+    post_delete.connect(create_tombstone, sender=model)
+
+
+@receiver(pre_delete, sender=Rotator)
+def touch_rotator_assets(sender, instance, **kwargs):
+    # Cascading deletes on the through table don't send m2m_changed, but every asset in
+    # this rotator has a different rotators list afterwards
+    Asset.objects.filter(rotators=instance).update(version=catalog_changed())
+
+
+@receiver(m2m_changed, sender=Asset.rotators.through)
+def touch_assets_on_rotators_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # Remember which assets are in this rotator, since pk_set is None for post_clear
+        instance._cleared_asset_pks = list(instance.assets.values_list('pk', flat=True))
+
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if reverse:
+            asset_pks = instance.__dict__.pop('_cleared_asset_pks', []) if action == 'post_clear' else pk_set
+        else:
+            asset_pks = (instance.pk,)
+
+        if asset_pks:
+            Asset.objects.filter(pk__in=asset_pks).update(version=catalog_changed())
+
+
+@receiver(post_save, sender=LogEntry)
+def add_log_entry_to_rollups(sender, instance, created, raw=False, **kwargs):
+    # Entries pushed by clients are bulk created (and rolled up) in views.log, this covers the
+    # ones created one at a time, like by admin edits
+    if created and not raw:
+        LogEntryRollup.add_log_entries((instance,))
+
+
+@receiver(config_updated)
+def config_changed(sender, key, old_value, new_value, **kwargs):
+    config_cache.clear()
+
+    # Client config is part of the export, so changing it needs to invalidate client catalogs.
+    # An old_value of None means it wasn't stored yet, ie it was the default.
+    if key.lower() in CLIENT_CONFIG_KEYS:
+        if old_value is None:
+            old_value = constance_settings.CONFIG[key][0]
+        if old_value != new_value:
+            with transaction.atomic():
+                catalog_changed()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def revoke_user_auth_tokens(sender, instance, **kwargs):
+    clear_user_auth_tokens(instance.id)
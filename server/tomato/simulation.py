@@ -0,0 +1,181 @@
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import itertools
+import json
+import os
+import random
+
+import django
+from django.conf import settings
+import numpy
+
+from .cache import get_config
+from .models import Asset, Rotator, StopSet, StopSetRotator
+from .selection import is_currently_airing, pick_asset_block, SelectionCache
+
+
+# Promised plays are what at least this percent of simulated trials reached
+PROMISE_PERCENTILE = 95
+
+AssetForecast = namedtuple('AssetForecast', ('id', 'name', 'rotators', 'plays', 'promised_plays', 'airtime'))
+RotatorForecast = namedtuple('RotatorForecast', ('id', 'name', 'color', 'plays', 'promised_plays', 'airtime'))
+PlayoutForecast = namedtuple('PlayoutForecast', ('begin', 'end', 'trials', 'assets', 'rotators'))
+
+
+class Playable:
+    """Stand-in for a stop set or asset with just what the simulation needs, so the catalog can
+    be sent to worker processes, which don't touch the database"""
+    __slots__ = ('id', 'index', 'weight', 'begin', 'end', 'duration')
+
+    def __init__(self, obj, index=None, duration=0):
+        self.id, self.index, self.weight, self.begin, self.end = obj.id, index, obj.weight, obj.begin, obj.end
+        self.duration = duration
+
+    def currently_airing(self, now):
+        return is_currently_airing(self.begin, self.end, now)
+
+
+Catalog = namedtuple('Catalog', ('stopsets', 'stopset_rotators', 'rotator_assets', 'rotator_indexes',
+                                 'num_assets', 'wait', 'wait_subtracts_playtime'))
+
+
+def load_catalog(assets, rotators):
+    # Same eligible objects, and in the same order, as StopSet.generate_asset_block() and
+    # Rotator.get_asset_selector() use
+    playables = {asset.id: Playable(asset, index, asset.duration.total_seconds())
+                 for index, asset in enumerate(assets)}
+    rotator_assets = defaultdict(list)
+    for rotator_id, asset_id in Asset.rotators.through.objects.filter(asset__enabled=True).order_by(
+            'asset_id').values_list('rotator_id', 'asset_id'):
+        rotator_assets[rotator_id].append(playables[asset_id])
+
+    stopset_rotators = defaultdict(list)
+    for stopset_id, rotator_id in StopSetRotator.objects.order_by('id').values_list('stopset_id', 'rotator_id'):
+        stopset_rotators[stopset_id].append(rotator_id)
+
+    return Catalog(
+        stopsets=[Playable(stopset) for stopset in StopSet.objects.filter(enabled=True).order_by('id')],
+        stopset_rotators=dict(stopset_rotators),
+        rotator_assets=dict(rotator_assets),
+        rotator_indexes={rotator.id: index for index, rotator in enumerate(rotators)},
+        num_assets=len(assets),
+        wait=60 * get_config('WAIT_INTERVAL_MINUTES'),
+        wait_subtracts_playtime=get_config('WAIT_INTERVAL_SUBTRACTS_STOPSET_PLAYTIME'),
+    )
+
+
+def simulate_trial(catalog, cache, begin, end):
+    """Plays out a catalog like the client's load_asset_block() from begin to end, returning plays
+    per asset, and plays and seconds of airtime per rotator"""
+    asset_plays = numpy.zeros(catalog.num_assets, dtype=numpy.int32)
+    rotator_plays = numpy.zeros(len(catalog.rotator_indexes), dtype=numpy.int32)
+    rotator_seconds = numpy.zeros(len(catalog.rotator_indexes))
+
+    now = begin
+    while now < end:
+        stopset_selector = cache.get_selector(None, now, None, lambda: catalog.stopsets)
+        playtime = 0
+
+        # Randomly select stopsets until one has an asset eligible to air
+        while stopset_selector:
+            stopset = stopset_selector.pick()
+            stopset_selector.exclude(stopset.id)
+
+            rotators = catalog.stopset_rotators.get(stopset.id, [])
+            rotator_selectors = {rotator: cache.get_selector(
+                rotator, now, None, lambda rotator=rotator: catalog.rotator_assets.get(rotator, []),
+            ) for rotator in set(rotators)}
+            asset_block = pick_asset_block(rotators, rotator_selectors)
+
+            if any(asset_block):
+                for rotator, asset in zip(rotators, asset_block):
+                    if asset:
+                        asset_plays[asset.index] += 1
+                        rotator_plays[catalog.rotator_indexes[rotator]] += 1
+                        rotator_seconds[catalog.rotator_indexes[rotator]] += asset.duration
+                        playtime += asset.duration
+                break
+
+        wait = catalog.wait
+        if catalog.wait_subtracts_playtime:
+            wait = round(max(0, wait - playtime))
+        # At least a second, so an empty catalog with no wait interval doesn't spin forever
+        now += datetime.timedelta(seconds=max(1, playtime + wait))
+
+    return asset_plays, rotator_plays, rotator_seconds
+
+
+def simulate_trials(catalog, begin, end, seeds):
+    # Selectors depend only on the catalog and eligibility window, so they're shared by every trial
+    cache = SelectionCache()
+    results = []
+    for seed in seeds:
+        random.seed(int(seed))
+        results.append(simulate_trial(catalog, cache, begin, end))
+    return tuple(numpy.stack(result) for result in zip(*results))
+
+
+def simulate_playout(begin, end, trials, seed=None, workers=None):
+    """Simulate playout from begin to end a number of times, each trial in the same way clients
+    pick stop sets and assets, spread across worker processes. Returns a PlayoutForecast of mean
+    plays and airtime, and plays promised by PROMISE_PERCENTILE percent of trials, per asset and
+    rotator."""
+    assets = list(Asset.objects.filter(enabled=True).order_by('id').only('id', 'name', 'weight', 'begin', 'end',
+                                                                         'duration').prefetch_related('rotators'))
+    rotators = list(Rotator.objects.order_by('name', 'id'))
+    catalog = load_catalog(assets, rotators)
+
+    workers = workers or settings.PLAYOUT_SIMULATION_WORKERS or os.cpu_count()
+    seeds = numpy.random.SeedSequence(seed).generate_state(trials)
+    chunks = [chunk for chunk in numpy.array_split(seeds, workers) if len(chunk)]
+
+    # Workers don't use the database, but set up Django in case they're spawned rather than forked
+    with ProcessPoolExecutor(max_workers=len(chunks), initializer=django.setup) as executor:
+        results = list(executor.map(simulate_trials, itertools.repeat(catalog), itertools.repeat(begin),
+                                    itertools.repeat(end), chunks))
+    asset_plays, rotator_plays, rotator_seconds = (numpy.concatenate(result) for result in zip(*results))
+
+    promise_percentile = 100 - PROMISE_PERCENTILE
+    asset_durations = numpy.array([asset.duration.total_seconds() for asset in assets])
+    asset_mean_plays = asset_plays.mean(axis=0)
+    asset_promised_plays = numpy.floor(numpy.percentile(asset_plays, promise_percentile, axis=0)).astype(int)
+    asset_airtime = asset_mean_plays * asset_durations
+    rotator_promised_plays = numpy.floor(numpy.percentile(rotator_plays, promise_percentile, axis=0)).astype(int)
+
+    return PlayoutForecast(
+        begin=begin,
+        end=end,
+        trials=trials,
+        assets=[AssetForecast(
+            asset.id, asset.name, [rotator.name for rotator in asset.rotators.all()],
+            asset_mean_plays[index], asset_promised_plays[index],
+            datetime.timedelta(seconds=round(asset_airtime[index])),
+        ) for index, asset in enumerate(assets)],
+        rotators=[RotatorForecast(
+            rotator.id, rotator.name, rotator.color, rotator_plays[:, index].mean(), rotator_promised_plays[index],
+            datetime.timedelta(seconds=round(rotator_seconds[:, index].mean())),
+        ) for index, rotator in enumerate(rotators)],
+    )
+
+
+def encode_forecast(forecast):
+    """JSON for a PlayoutForecast's assets and rotators, to store on a ForecastJob"""
+    return json.dumps({
+        'assets': [[row.id, row.name, row.rotators, float(row.plays), int(row.promised_plays),
+                    row.airtime.total_seconds()] for row in forecast.assets],
+        'rotators': [[row.id, row.name, row.color, float(row.plays), int(row.promised_plays),
+                      row.airtime.total_seconds()] for row in forecast.rotators],
+    })
+
+
+def decode_forecast(job):
+    """The PlayoutForecast stored on a finished ForecastJob"""
+    data = json.loads(job.forecast)
+    return PlayoutForecast(
+        begin=job.begin,
+        end=job.end,
+        trials=job.trials,
+        assets=[AssetForecast(*row[:-1], datetime.timedelta(seconds=row[-1])) for row in data['assets']],
+        rotators=[RotatorForecast(*row[:-1], datetime.timedelta(seconds=row[-1])) for row in data['rotators']],
+    )
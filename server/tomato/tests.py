@@ -1,24 +1,70 @@
-from collections import namedtuple
+from collections import Counter, namedtuple
 from base64 import b64decode
+import csv
 import datetime
+import decimal
+import fcntl
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
 import shutil
+import struct
 import tempfile
+import threading
+from unittest import mock, skipUnless
+import uuid
+import wave
 
 from django.contrib.auth.models import User
+from django.core.cache import caches
+from constance import config
 from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.serializers import serialize
 from django.conf import settings
+from django.db import connection, IntegrityError, OperationalError, transaction
+from django.db.models.signals import post_save
 from django.test import Client, override_settings, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from .models import Asset, LogEntry, Rotator, StopSet, StopSetRotator
+from .audio_metadata import read_audio_metadata
+from .cache import catalog_version_cache, config_cache
+from .columnar import decode_tables
+from .export import get_export_snapshot, iter_columnar_json, json_dumps
+from .management.commands.process_uploads import Command as ProcessUploadsCommand
+from .models import (asset_selection_cache, get_catalog_version, get_latest_tomato_migration, next_catalog_version,
+                     probe_audio_file, Asset, ForecastJob, LogEntry, LogEntryRollup, Rotator, StopSet, StagedFile,
+                     StopSetRotator, UploadJob)
+from .selection import WeightedSelector
+from .simulation import decode_forecast, encode_forecast, simulate_playout
 
 
 Dataset = namedtuple('Dataset', ('asset', 'rotator', 'stopset', 'log_entry'))
 
 
-@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), EXPORT_SNAPSHOT_LOCK_ROOT=tempfile.mkdtemp(), CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'export': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'export'},
+    'auth': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'auth'},
+})
 class ServerTests(TestCase):
     def setUp(self):
+        caches['export'].clear()
+        caches['auth'].clear()
+        catalog_version_cache.clear()
+        config_cache.clear()
+        # Catalog versions repeat between tests, since each is rolled back
+        asset_selection_cache.clear()
+        # Worker commands close old connections between jobs, which would end each test's transaction
+        for command in ('process_forecasts', 'process_uploads'):
+            patcher = mock.patch(f'tomato.management.commands.{command}.close_old_connections')
+            patcher.start()
+            self.addCleanup(patcher.stop)
         self.colors = {v: k for k, v in Rotator.COLOR_CHOICES}
         self.user = User.objects.create_user(username='user', password='user')
         self.super = User.objects.create_superuser(username='super', password='super')
@@ -43,6 +89,16 @@ class ServerTests(TestCase):
 
         return Dataset(asset, rotator, stopset, log_entry)
 
+    def get_wav_file(self, name):
+        file = ContentFile(b64decode(b'UklGRiQAAABXQVZFZm10IBAAAAABAAEARKwAAIhYAQACABAAZGF0YQAAAAA='))
+        file.name = name
+        return file
+
+    def get_export(self, **params):
+        response = self.client.get(reverse('export'), data=params)
+        self.assertTrue(response.streaming)
+        return json.loads(b''.join(response.streaming_content))
+
     def test_admin_urls(self):
         self.client.login(username='super', password='super')
         data = self.create_basic_data()
@@ -68,6 +124,523 @@ class ServerTests(TestCase):
             response = self.client.get(test_url)
             self.assertEqual(response.status_code, 200)
 
+    def test_admin_num_assets(self):
+        self.client.login(username='super', password='super')
+        now = timezone.now()
+        busy, quiet, empty = (Rotator.objects.create(name=name) for name in ('busy', 'quiet', 'empty'))
+        Asset.objects.bulk_create(
+            Asset(name=name, audio=f'{name}.wav', duration=datetime.timedelta(0), audio_size=0, **kwargs)
+            for name, kwargs in (('on', {}), ('off', {'enabled': False}),
+                                 ('ended', {'end': now - datetime.timedelta(days=1)}), ('other', {})))
+        on, off, ended, other = Asset.objects.order_by('id')
+        busy.assets.add(on, off, ended)
+        quiet.assets.add(on, other)
+        stopset = StopSet.objects.create(name='stopset')
+        for rotator in (busy, busy, quiet):
+            StopSetRotator.objects.create(stopset=stopset, rotator=rotator)
+
+        def get_changelist(model, **params):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(f'admin:tomato_{model}_changelist'), data=params)
+            return response, len(queries)
+
+        response, _ = get_changelist('rotator', o=4)
+        # Ordered by total number of assets
+        self.assertEqual([(rotator.name, rotator.num_assets_enabled, rotator.num_assets_total)
+                          for rotator in response.context['cl'].result_list],
+                         [('empty', 0, 0), ('quiet', 2, 2), ('busy', 1, 3)])
+        self.assertContains(response, '3 Total<br><em>(1 Airing / 2 Not Currently Airing)</em>', html=True)
+
+        # Assets are counted once, even if in multiple rotators or rotators appear more than once
+        response, _ = get_changelist('stopset')
+        stopset = response.context['cl'].result_list[0]
+        self.assertEqual((stopset.num_assets_enabled, stopset.num_assets_total), (2, 4))
+
+        # Number of queries doesn't depend on the number of rows
+        _, num_queries = get_changelist('rotator', o=4)
+        for num in range(10):
+            Rotator.objects.create(name=f'rotator {num}').assets.add(on, off)
+        self.assertEqual(get_changelist('rotator', o=4)[1], num_queries)
+
+        # Actions still work on the annotated queryset
+        self.client.post(reverse('admin:tomato_rotator_changelist'), {
+            'action': 'delete_selected', '_selected_action': [empty.id, quiet.id], 'post': 'yes'})
+        self.assertFalse(Rotator.objects.filter(id__in=(empty.id, quiet.id)).exists())
+
+    def test_admin_rotator_entries(self):
+        self.client.login(username='super', password='super')
+        rotators = [Rotator.objects.create(name=f'rotator {num}') for num in range(3)]
+
+        def create_stopset(num):
+            stopset = StopSet.objects.create(name=f'stopset {num}')
+            for rotator in rotators + rotators[:1]:
+                StopSetRotator.objects.create(stopset=stopset, rotator=rotator)
+            return stopset
+
+        def get_num_queries(url):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            return response, len(queries)
+
+        stopset = create_stopset(0)
+        changelist_url = reverse('admin:tomato_stopset_changelist')
+        get_num_queries(changelist_url)  # Warm up
+        response, num_queries = get_num_queries(changelist_url)
+        self.assertContains(response, '4. rotator 0</span>')
+
+        for num in range(1, 6):
+            create_stopset(num)
+        self.assertEqual(get_num_queries(changelist_url)[1], num_queries)
+
+        # Inline entries are numbered without a query each
+        change_url = reverse('admin:tomato_stopset_change', args=(stopset.id,))
+        get_num_queries(change_url)  # Warm up
+        response, num_queries = get_num_queries(change_url)
+        self.assertContains(response, '1. rotator 0 in stopset 0')
+        self.assertContains(response, '4. rotator 0 in stopset 0')
+        for rotator in rotators:
+            StopSetRotator.objects.create(stopset=stopset, rotator=rotator)
+        response, more_entries_num_queries = get_num_queries(change_url)
+        self.assertContains(response, '7. rotator 2 in stopset 0')
+        self.assertEqual(more_entries_num_queries, num_queries)
+
+    def test_admin_rotator_actions(self):
+        self.client.login(username='super', password='super')
+        rotator = Rotator.objects.create(name='rotator')
+
+        def run_action(action, num_assets):
+            Asset.objects.all().delete()
+            Asset.objects.bulk_create(
+                Asset(name=f'asset {num}', audio=f'{num}.wav', duration=datetime.timedelta(0), audio_size=0)
+                for num in range(num_assets))
+            asset_ids = list(Asset.objects.values_list('id', flat=True))
+            # One already in the rotator, which is ignored when adding
+            Asset.objects.get(id=asset_ids[0]).rotators.add(rotator)
+            version = get_catalog_version()
+
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse('admin:tomato_asset_changelist'), {
+                    'action': action, 'rotator': rotator.id, '_selected_action': asset_ids})
+            self.assertEqual(response.status_code, 302)
+            # Every asset's rotators changed, so it needs to be synced again
+            self.assertFalse(Asset.objects.filter(version__lte=version).exists())
+            return len(queries)
+
+        run_action('add_rotator', 1)  # Warm up
+        num_queries = run_action('add_rotator', 5)
+        self.assertEqual(rotator.assets.count(), 5)
+        self.assertEqual(run_action('add_rotator', 50), num_queries)
+        self.assertEqual(rotator.assets.count(), 50)
+
+        num_queries = run_action('remove_rotator', 5)
+        self.assertFalse(rotator.assets.exists())
+        self.assertEqual(run_action('remove_rotator', 50), num_queries)
+        self.assertFalse(rotator.assets.exists())
+
+    def test_admin_log_export(self):
+        self.client.login(username='super', password='super')
+        self.user.first_name, self.user.last_name = 'Jane', 'Doe'
+        self.user.save()
+        tz = timezone.get_current_timezone()
+        for day, action in ((1, 'played_asset'), (2, 'waited'), (3, 'played_asset')):
+            LogEntry.objects.create(
+                user_id=self.user.id, action=action, description=f'day {day}',
+                created=tz.localize(datetime.datetime(2020, 3, day, 23, 30)))
+
+        def export(**params):
+            response = self.client.get(reverse('admin:tomato_logentry_export'), data=params)
+            self.assertTrue(response.streaming)
+            rows = b''.join(response.streaming_content).decode('utf8').splitlines()
+            self.assertEqual(rows[0], 'Date,Action,User,Duration (if any),Description (if any)')
+            return rows[1:]
+
+        rows = export(begin='', end='')
+        self.assertEqual(len(rows), 3)
+        self.assertTrue(all(',Jane Doe,' in row for row in rows))
+
+        rows = export(begin='2020-03-02', end='2020-03-03')
+        self.assertEqual([row.rsplit(',', 1)[1] for row in rows], ['day 3', 'day 2'])
+        rows = export(end='2020-03-02', actions='played_asset')
+        self.assertEqual([row.rsplit(',', 1)[1] for row in rows], ['day 1'])
+
+        # Invalid ranges redisplay the form
+        response = self.client.get(reverse('admin:tomato_logentry_export'),
+                                   data={'begin': '2020-03-03', 'end': '2020-03-01'})
+        self.assertFalse(response.streaming)
+        self.assertContains(response, 'From Date must be before To Date.')
+
+    def test_weighted_selection(self):
+        Obj = namedtuple('Obj', 'id')
+        objs = [Obj(num) for num in range(10)]
+        selector = WeightedSelector(objs, [decimal.Decimal(num) / 2 for num in range(10)])
+        counts = Counter(selector.pick().id for _ in range(20000))
+        self.assertNotIn(0, counts)  # Zero weight
+        self.assertAlmostEqual(counts[9] / counts[1], 9, delta=2)
+
+        copied = selector.copy()
+        for num in range(1, 9):
+            copied.exclude(num)
+        self.assertEqual({copied.pick().id for _ in range(100)}, {9})
+        copied.exclude(9)
+        self.assertFalse(copied)
+        self.assertIsNone(copied.pick())
+        # The original is untouched
+        self.assertEqual(len({selector.pick().id for _ in range(1000)}), 9)
+
+    def test_generate_asset_block(self):
+        now = timezone.now()
+        rotators = [Rotator.objects.create(name=f'rotator {num}') for num in range(2)]
+        stopset = StopSet.objects.create(name='stopset')
+        for rotator in rotators * 3:
+            StopSetRotator.objects.create(stopset=stopset, rotator=rotator)
+        assets = Asset.objects.bulk_create(
+            Asset(name=f'asset {num}', audio=f'{num}.wav', duration=datetime.timedelta(0), audio_size=0,
+                  begin=now + datetime.timedelta(days=1) if num == 5 else None) for num in range(6))
+        assets = list(Asset.objects.order_by('id'))
+        rotators[0].add_assets([asset.id for asset in assets[:4]])
+        rotators[1].add_assets([asset.id for asset in assets[2:]])
+
+        rotator_asset_ids = {rotator: set(rotator.assets.values_list('id', flat=True)) for rotator in rotators}
+        for _ in range(20):
+            block = [(rotator, asset.id) for rotator, asset in stopset.generate_asset_block(now) if asset]
+            # No asset twice, even across rotators, and not the future one
+            self.assertEqual(len({asset_id for _, asset_id in block}), len(block))
+            self.assertNotIn(assets[5].id, {asset_id for _, asset_id in block})
+            for rotator, asset_id in block:
+                self.assertIn(asset_id, rotator_asset_ids[rotator])
+
+        # Selectors are cached, so later blocks only query for the version and the stop set's rotators
+        with CaptureQueriesContext(connection) as queries:
+            stopset.generate_asset_block(now)
+        self.assertEqual(len(queries), 2)
+
+        # Another eligibility window
+        version = get_catalog_version()
+        self.assertNotIn(assets[5].id, rotators[1].get_asset_selector(now, version).positions)
+        later = now + datetime.timedelta(days=2)
+        self.assertIn(assets[5].id, rotators[1].get_asset_selector(later, version).positions)
+
+        # Catalog changes are picked up
+        Asset.objects.exclude(id=assets[0].id).update(enabled=False)
+        next_catalog_version()
+        block_assets = [asset for _, asset in stopset.generate_asset_block(now)]
+        self.assertEqual([asset and asset.id for asset in block_assets], [assets[0].id] + [None] * 5)
+
+    def test_playout_forecast(self):
+        begin = timezone.now()
+        rotators = [Rotator.objects.create(name=f'rotator {num}') for num in range(2)]
+        stopset = StopSet.objects.create(name='stopset')
+        for rotator in rotators:
+            StopSetRotator.objects.create(stopset=stopset, rotator=rotator)
+        Asset.objects.bulk_create(
+            Asset(name=f'asset {num}', audio=f'{num}.wav', duration=datetime.timedelta(seconds=30), audio_size=0,
+                  begin=begin + datetime.timedelta(days=2) if num == 2 else None) for num in range(4))
+        assets = list(Asset.objects.order_by('id'))
+        rotators[0].add_assets([asset.id for asset in assets[:3]])
+        rotators[1].add_assets([assets[3].id])
+
+        # A minute of audio then 20 minute waits, so 69 stop sets in a day
+        forecast = simulate_playout(begin, begin + datetime.timedelta(days=1), trials=4, seed=1, workers=2)
+        self.assertEqual([(rotator.plays, rotator.promised_plays, rotator.airtime) for rotator in forecast.rotators],
+                         [(69, 69, datetime.timedelta(seconds=69 * 30))] * 2)
+        asset_plays = {asset.name: asset.plays for asset in forecast.assets}
+        self.assertEqual(asset_plays['asset 0'] + asset_plays['asset 1'], 69)
+        self.assertEqual(asset_plays['asset 2'], 0)  # Not eligible until after the forecast
+        self.assertEqual(asset_plays['asset 3'], 69)
+
+        # Same seed, same forecast
+        self.assertEqual(simulate_playout(begin, begin + datetime.timedelta(days=1), trials=4, seed=1, workers=2),
+                         forecast)
+
+        stdout = io.StringIO()
+        call_command('simulate_playout', '--hours=1', '--trials=2', '--workers=1', '--csv', stdout=stdout)
+        rows = list(csv.reader(stdout.getvalue().splitlines()))
+        self.assertEqual(rows[1], ['rotator', 'rotator 0', '3.0', '3', '0:01:30'])
+        self.assertEqual(len(rows), 1 + len(rotators) + len(assets))
+
+        # Forecasts from the admin are queued, rather than simulated during the request
+        self.client.login(username='super', password='super')
+        self.assertEqual(self.client.get(reverse('admin:tomato_asset_forecast')).status_code, 200)
+        response = self.client.post(reverse('admin:tomato_asset_forecast'), {'days': '0.5', 'trials': 2})
+        job = ForecastJob.objects.get()
+        result_url = reverse('admin:tomato_asset_forecast_result', args=(job.id,))
+        self.assertRedirects(response, result_url)
+        self.assertContains(self.client.get(result_url), 'This page will refresh automatically.')
+
+        with self.settings(PLAYOUT_SIMULATION_WORKERS=1):
+            call_command('process_forecasts', once=True, stdout=io.StringIO())
+        response = self.client.get(result_url)
+        self.assertEqual(response.context_data['forecast'].trials, 2)
+        self.assertEqual([row.name for row in response.context_data['forecast'].assets],
+                         [asset.name for asset in assets])
+        self.assertContains(response, 'asset 3')
+
+        # Stored and loaded as is
+        job.refresh_from_db()
+        job.forecast = encode_forecast(forecast)
+        self.assertEqual(decode_forecast(job)._replace(begin=forecast.begin, end=forecast.end, trials=forecast.trials),
+                         forecast)
+
+    def test_upload_view(self):
+        self.client.login(username='super', password='super')
+        rotator = Rotator.objects.create(name='rotator')
+        # Trimming probes before and after, see test_upload_trimming
+        config.STRIP_UPLOADED_AUDIO = False
+
+        with mock.patch('tomato.models.probe_audio_file', wraps=probe_audio_file) as probe:
+            response = self.client.post(reverse('admin:tomato_asset_upload'), {
+                'audios': [self.get_wav_file(f'test{num}.wav') for num in range(3)] + [
+                    ContentFile(b'not audio', name='corrupt.wav')],
+                'rotators': [rotator.id]})
+
+            # Files are only staged by the request
+            batch = UploadJob.objects.values_list('batch', flat=True).first()
+            progress_url = reverse('admin:tomato_asset_upload_progress', args=(batch,))
+            self.assertRedirects(response, progress_url)
+            self.assertEqual(probe.call_count, 0)
+            self.assertFalse(Asset.objects.exists())
+            self.assertContains(self.client.get(progress_url), 'Processed 0 of 4 audio files.')
+
+            call_command('process_uploads', once=True, stdout=io.StringIO(), stderr=io.StringIO())
+
+        # Each file is probed exactly once, for both cleaning and saving
+        self.assertEqual(probe.call_count, 4)
+        self.assertQuerysetEqual(Asset.objects.order_by('name'), ['test0', 'test1', 'test2'],
+                                 transform=lambda asset: asset.name)
+        self.assertEqual(rotator.assets.count(), 3)
+        self.assertEqual(sorted(os.listdir(os.path.join(settings.MEDIA_ROOT, 'staging'))), [])
+
+        response = self.client.get(progress_url)
+        self.assertContains(response, 'Finished processing 4 audio files')
+        self.assertContains(response, '1 failed')
+        self.assertContains(response, "Detected mime type text/plain for &#x27;corrupt.wav&#x27;")
+
+        response = self.client.post(reverse('admin:tomato_asset_upload'), {
+            'audios': [self.get_wav_file('good.wav'), self.get_wav_file('bad.txt')]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Invalid file extension: &#x27;bad.txt&#x27;")
+        self.assertEqual(UploadJob.objects.count(), 4)
+
+    def test_audio_dedupe(self):
+        self.client.login(username='super', password='super')
+        wav = self.get_wav_file('test.wav')
+        audio_hash = hashlib.sha256(wav.read()).hexdigest()
+
+        self.client.post(reverse('admin:tomato_asset_upload'), {
+            'audios': [self.get_wav_file('first.wav'), self.get_wav_file('second.wav')]})
+        # Hashed as it was uploaded
+        self.assertEqual(set(UploadJob.objects.values_list('audio_hash', flat=True)), {audio_hash})
+        call_command('process_uploads', once=True, stdout=io.StringIO(), stderr=io.StringIO())
+
+        first, second = Asset.objects.order_by('id')
+        self.assertEqual((first.name, second.name), ('first', 'second'))
+        self.assertEqual(first.audio_hash, audio_hash)
+        self.assertEqual(first.audio.name, f'assets/{audio_hash[:2]}/{audio_hash}/first.wav')
+        self.assertEqual(second.audio.name, first.audio.name)
+        self.assertEqual(os.listdir(os.path.dirname(first.audio.path)), ['first.wav'])
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, 'staging')), [])
+
+        self.assertEqual({obj['fields']['audio_hash'] for obj in self.get_export(since=0)['objects']
+                          if obj['model'] == 'tomato.asset'}, {audio_hash})
+
+    def test_waveform_peaks(self):
+        # One second of 8kHz 16-bit mono, loud for the first half then quiet
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav:
+            wav.setparams((1, 2, 8000, 0, 'NONE', None))
+            wav.writeframes(struct.pack('<8000h', *([16384, -16384] * 2000 + [256, -512] * 2000)))
+
+        def get_asset(name):
+            path = os.path.join(settings.MEDIA_ROOT, name)
+            with open(path, 'wb') as file:
+                file.write(buffer.getvalue())
+            return Asset(audio=StagedFile(open(path, 'rb'), name=name))
+
+        asset = get_asset('peaks.wav')
+        asset.save()
+
+        peaks = list(struct.unpack('20b', b64decode(asset.waveform_peaks)))
+        self.assertEqual(peaks, [64, -64] * 5 + [1, -2] * 5)
+
+        # Identical audio reuses them
+        duplicate = get_asset('duplicate.wav')
+        with mock.patch('tomato.models.get_waveform_peaks') as get_waveform_peaks:
+            duplicate.save()
+        get_waveform_peaks.assert_not_called()
+        self.assertEqual(duplicate.waveform_peaks, asset.waveform_peaks)
+
+    def test_upload_trimming(self):
+        self.client.login(username='super', password='super')
+
+        def make_wav(num_frames):
+            buffer = io.BytesIO()
+            with wave.open(buffer, 'wb') as wav:
+                wav.setparams((1, 2, 8000, 0, 'NONE', None))
+                wav.writeframes(bytes(num_frames * 2))
+            return buffer.getvalue()
+
+        def trim_audio_file(path, trimmed_path):
+            # Only one has silence, but sox re-encodes either way, here with an extra trailing byte
+            with open(trimmed_path, 'wb') as file:
+                file.write(make_wav(4000) if 'quiet' in path else make_wav(8000) + b'\0')
+
+        with mock.patch('tomato.models.trim_audio_file', side_effect=trim_audio_file) as trim:
+            for name, strip in (('quiet.wav', True), ('loud.wav', True), ('untrimmed.wav', False)):
+                config.STRIP_UPLOADED_AUDIO = strip
+                self.client.post(reverse('admin:tomato_asset_upload'), {
+                    'audios': [ContentFile(make_wav(8000), name=name)]})
+                call_command('process_uploads', once=True, stdout=io.StringIO(), stderr=io.StringIO())
+
+        self.assertEqual(trim.call_count, 2)
+        trimmed, loud, untrimmed = Asset.objects.order_by('id')
+        self.assertEqual(trimmed.duration, datetime.timedelta(seconds=0.5))
+        self.assertEqual(trimmed.audio_size, len(make_wav(4000)))
+        self.assertEqual(trimmed.audio_hash, hashlib.sha256(make_wav(4000)).hexdigest())
+        # Nothing was trimmed, so the original is kept rather than the re-encoded copy
+        self.assertEqual(loud.audio_size, len(make_wav(8000)))
+        self.assertEqual(loud.audio_hash, hashlib.sha256(make_wav(8000)).hexdigest())
+        self.assertEqual(untrimmed.duration, datetime.timedelta(seconds=1))
+        self.assertEqual(untrimmed.audio_size, len(make_wav(8000)))
+
+        # Trimming is saved before the job is processed, so if it's retried it isn't re-encoded again
+        config.STRIP_UPLOADED_AUDIO = True
+        self.client.post(reverse('admin:tomato_asset_upload'), {
+            'audios': [ContentFile(make_wav(8000), name='quiet_retried.wav')]})
+        with mock.patch('tomato.models.trim_audio_file', side_effect=trim_audio_file) as trim:
+            ProcessUploadsCommand().trim_jobs_audio(UploadJob.claim(1, settings.UPLOAD_JOB_STALE_TIMEOUT))
+            job = UploadJob.objects.get(filename='quiet_retried.wav')
+            self.assertEqual((job.trimmed, job.audio_hash), (True, ''))
+
+            UploadJob.objects.filter(id=job.id).update(status=UploadJob.STATUS_PENDING)
+            call_command('process_uploads', once=True, stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(trim.call_count, 1)
+        self.assertEqual(Asset.objects.get(name='quiet_retried').duration, datetime.timedelta(seconds=0.5))
+
+    def test_upload_job_errors(self):
+        self.client.login(username='super', password='super')
+        self.client.post(reverse('admin:tomato_asset_upload'), {
+            'audios': [self.get_wav_file(f'{name}.wav') for name in ('missing', 'unreadable', 'good')]})
+        os.remove(UploadJob.objects.get(filename='missing.wav').audio.path)
+
+        def probe_audio_file_or_fail(path):
+            if 'unreadable' in path:
+                raise PermissionError(f'Permission denied: {path!r}')
+            return probe_audio_file(path)
+
+        with mock.patch('tomato.models.probe_audio_file', side_effect=probe_audio_file_or_fail):
+            call_command('process_uploads', once=True, stdout=io.StringIO(), stderr=io.StringIO())
+
+        # One bad file doesn't take down the rest of the batch
+        self.assertQuerysetEqual(Asset.objects.all(), ['good'], transform=lambda asset: asset.name)
+        jobs = {job.filename: job for job in UploadJob.objects.all()}
+        self.assertEqual({filename: job.status for filename, job in jobs.items()},
+                         {'missing.wav': 'failed', 'unreadable.wav': 'failed', 'good.wav': 'done'})
+        self.assertIn('No such file or directory', jobs['missing.wav'].errors)
+        self.assertIn('Permission denied', jobs['unreadable.wav'].errors)
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, 'staging')), [])
+
+    def test_upload_job_claim(self):
+        now = timezone.now()
+        stale = now - settings.UPLOAD_JOB_STALE_TIMEOUT - datetime.timedelta(seconds=1)
+        pending, processing, stale_processing, done = (
+            UploadJob.objects.create(batch=uuid.uuid4(), filename=status, status=status, updated=updated)
+            for status, updated in (('pending', now), ('processing', now), ('processing', stale), ('done', now)))
+
+        self.assertEqual({job.id for job in UploadJob.claim(10, settings.UPLOAD_JOB_STALE_TIMEOUT)},
+                         {pending.id, stale_processing.id})
+        # Nothing left for another worker
+        self.assertEqual(UploadJob.claim(10, settings.UPLOAD_JOB_STALE_TIMEOUT), [])
+
+    def test_worker_reconnects(self):
+        for command, model, poll_interval in (
+            ('process_uploads', 'UploadJob', settings.UPLOAD_JOB_POLL_INTERVAL),
+            ('process_forecasts', 'ForecastJob', settings.FORECAST_JOB_POLL_INTERVAL),
+        ):
+            module = f'tomato.management.commands.{command}'
+            stderr = io.StringIO()
+            claim_results = [OperationalError('connection lost'), []]
+            with mock.patch(f'{module}.{model}.claim', side_effect=claim_results) as claim, \
+                    mock.patch(f'{module}.close_old_connections') as close_old_connections, \
+                    mock.patch(f'{module}.connection') as worker_connection, \
+                    mock.patch(f'{module}.time.sleep') as sleep:
+                call_command(command, once=True, stdout=io.StringIO(), stderr=stderr)
+
+            # Old connections are dropped before each claim, and the one that failed is closed for the next
+            self.assertEqual(claim.call_count, 2, command)
+            self.assertEqual(close_old_connections.call_count, 2, command)
+            worker_connection.close.assert_called_once_with()
+            sleep.assert_called_once_with(poll_interval)
+            self.assertIn('Database error: connection lost', stderr.getvalue())
+
+    def test_audio_metadata(self):
+        def vorbis_comments(**tags):
+            comments = [f'{key.upper()}={value}'.encode('utf8') for key, value in tags.items()]
+            return struct.pack('<I', 6) + b'tomato' + struct.pack('<I', len(comments)) + b''.join(
+                struct.pack('<I', len(comment)) + comment for comment in comments)
+
+        def ogg_page(granule_position, *packets):
+            segments = b''.join(bytes([255] * (len(packet) // 255) + [len(packet) % 255]) for packet in packets)
+            return (b'OggS\0\0' + struct.pack('<qIIIB', granule_position, 1, 0, 0, len(segments))
+                    + segments + b''.join(packets))
+
+        # 1.5 seconds of 8kHz, 16-bit mono
+        info = b'INFO' + b'INAM' + struct.pack('<I', 6) + b'Title\0' + b'IART' + struct.pack('<I', 7) + b'Artist\0\0'
+        wav = (b'WAVE' + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, 1, 8000, 16000, 2, 16)
+               + b'LIST' + struct.pack('<I', len(info)) + info + b'data' + struct.pack('<I', 24000) + bytes(24000))
+        wav = b'RIFF' + struct.pack('<I', len(wav)) + wav
+
+        # 10 seconds of 44.1kHz, with an ID3v2 tag in front
+        streaminfo = bytes(10) + (44100 << 44 | 441000).to_bytes(8, 'big') + bytes(16)
+        comments = vorbis_comments(title='Title', artist='Artist')
+        flac = (b'ID3\3\0\0\0\0\0\0' + b'fLaC' + struct.pack('>I', len(streaminfo)) + streaminfo
+                + struct.pack('>I', 1 << 31 | 4 << 24 | len(comments)) + comments)
+
+        # 2.5 seconds of 48kHz, with a comment header longer than one segment
+        ogg = (ogg_page(0, b'\x01vorbis' + struct.pack('<IBI', 0, 2, 48000) + bytes(15))
+               + ogg_page(0, b'\x03vorbis' + vorbis_comments(title='T' * 300, artist='Artist'))
+               + ogg_page(120000, bytes(100)))
+
+        # 100 frames of 128kbps 44.1kHz stereo, so 100 * 1152 samples, with a Xing header
+        id3 = b'TIT2' + struct.pack('>I', 7) + b'\0\0' + b'\3Title\0' + b'TPE1' + struct.pack('>I', 7) + b'\0\0\0Artist'
+        first_frame = b'\xff\xfb\x90\x00' + bytes(32) + b'Xing' + struct.pack('>II', 1, 100)
+        mp3 = (b'ID3\3\0\0' + bytes([0, 0, 0, len(id3)]) + id3 + b'junk\xff'
+               + first_frame + bytes(417 - len(first_frame)) + (b'\xff\xfb\x90\x00' + bytes(413)) * 99)
+        # The same without the Xing header, so duration comes from the bitrate
+        cbr_mp3 = (b'\xff\xfb\x90\x00' + bytes(413)) * 100 + b'TAG' + bytes(125)
+
+        for name, data, file_type, duration, tags in (
+            ('test.wav', wav, 'wav', 1.5, {'title': 'Title', 'artist': 'Artist'}),
+            ('test.flac', flac, 'flac', 10, {'title': 'Title', 'artist': 'Artist'}),
+            ('test.ogg', ogg, 'vorbis', 2.5, {'title': 'T' * 300, 'artist': 'Artist'}),
+            ('test.mp3', mp3, 'mp3', 100 * 1152 / 44100, {'title': 'Title', 'artist': 'Artist'}),
+            ('cbr.mp3', cbr_mp3, 'mp3', 100 * 417 * 8 / 128000, {}),
+        ):
+            with tempfile.NamedTemporaryFile(suffix=name) as file:
+                file.write(data)
+                file.flush()
+
+                probe = read_audio_metadata(file.name)
+                self.assertEqual(probe.file_type, file_type, name)
+                self.assertAlmostEqual(probe.duration, duration, msg=name)
+                self.assertEqual(probe.tags, tags, name)
+                ext = os.path.splitext(name)[1]
+                self.assertTrue(probe.mime.endswith(settings.VALID_AUDIO_FILE_TYPES[ext]['mime']), name)
+
+        # Left to sox and file, which reject them
+        rng = random.Random(0)
+        for name, data in (
+            ('junk.mp3', b'not an audio file'),
+            ('truncated.flac', b'fLaC' + struct.pack('>I', 1 << 31 | 4) + bytes(4)),
+            # A lone frame header, with the file ending before its next frame would
+            ('one_frame.mp3', b'\xff\xfb\x90\x00' + bytes(100)),
+        ) + tuple((f'random{num}.mp3', rng.randbytes(200 * 1024)) for num in range(50)):
+            with tempfile.NamedTemporaryFile(suffix=name) as file:
+                file.write(data)
+                file.flush()
+                self.assertIsNone(read_audio_metadata(file.name), name)
+
     def test_authenticate_view(self):
         response = self.client.get(reverse('admin:index'))
         self.assertNotEqual(response.status_code, 200)
@@ -95,3 +668,420 @@ class ServerTests(TestCase):
         self.assertEqual(response.status_code, 200)
 
         # TODO: test response value
+
+    def test_export_delta(self):
+        self.client.login(username='user', password='user')
+        data = self.create_basic_data()
+
+        response = self.get_export()
+        self.assertFalse(response['delta'])
+        self.assertEqual(len(response['objects']), 4)
+        version = response['version']
+
+        response = self.get_export(since=version)
+        self.assertTrue(response['delta'])
+        self.assertEqual(response['objects'], [])
+        self.assertEqual(response['deleted'], {})
+
+        data.asset.rotators.clear()
+        stopset_id, stopset_rotator_id = data.stopset.id, data.stopset.stopsetrotator_set.get().id
+        data.stopset.delete()
+
+        response = self.get_export(since=version)
+        self.assertGreater(response['version'], version)
+        self.assertEqual([(obj['model'], obj['pk'], obj['fields']['rotators']) for obj in response['objects']],
+                         [('tomato.asset', data.asset.id, [])])
+        self.assertEqual(response['deleted'], {'tomato.stopset': [stopset_id],
+                                               'tomato.stopsetrotator': [stopset_rotator_id]})
+
+        # A version from the future (eg, a reset database) gets a full export
+        response = self.get_export(since=response['version'] + 1)
+        self.assertFalse(response['delta'])
+        self.assertEqual(len(response['objects']), 2)
+
+    def test_export_etag(self):
+        self.client.login(username='user', password='user')
+        data = self.create_basic_data()
+
+        response = self.client.get(reverse('export'))
+        etag, version = response['ETag'], json.loads(b''.join(response.streaming_content))['version']
+        self.assertEqual(self.client.get(reverse('ping')).json()['catalog_version'], version)
+
+        response = self.client.get(reverse('export'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # Clients send back their catalog version
+        response = self.client.get(reverse('export'), HTTP_IF_NONE_MATCH=f'"{version}"')
+        self.assertEqual(response.status_code, 304)
+
+        data.rotator.name = 'renamed'
+        data.rotator.save()
+        response = self.client.get(reverse('export'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        config.FADE_ASSETS_MS = 500
+        response = self.client.get(reverse('export'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['conf']['fade_assets_ms'], 500)
+
+    def test_export_streaming(self):
+        self.client.login(username='user', password='user')
+        data = self.create_basic_data()
+
+        # Delta exports aren't snapshotted, so since=0 streams everything
+        response = self.client.get(reverse('export'), data={'since': 0}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        exported = json.loads(gzip.decompress(b''.join(response.streaming_content)))
+
+        self.assertEqual(exported['conf']['wait_interval_minutes'], 20)
+        self.assertEqual([(obj['model'], obj['pk']) for obj in exported['objects']], [
+            ('tomato.asset', data.asset.id),
+            ('tomato.rotator', data.rotator.id),
+            ('tomato.stopset', data.stopset.id),
+            ('tomato.stopsetrotator', data.stopset.stopsetrotator_set.get().id),
+        ])
+        self.assertEqual(exported['objects'][0]['fields']['rotators'], [data.rotator.id])
+        self.assertEqual(exported['objects'][0]['fields']['weight'], '1.00')
+
+    def test_export_num_queries(self):
+        self.client.login(username='user', password='user')
+        data = self.create_basic_data()
+        other_rotator = Rotator.objects.create(name='another rotator')
+
+        def num_export_queries():
+            with CaptureQueriesContext(connection) as context:
+                exported = self.get_export()
+            return len(context.captured_queries), exported
+
+        self.get_export()  # Let constance store its defaults first
+        num_queries, _ = num_export_queries()
+
+        Asset.objects.bulk_create(
+            Asset(name=f'asset #{n}', audio=data.asset.audio.name, audio_size=data.asset.audio_size,
+                  duration=datetime.timedelta(seconds=n)) for n in range(25))
+        Asset.rotators.through.objects.bulk_create(
+            Asset.rotators.through(asset=asset, rotator=rotator)
+            for asset in Asset.objects.exclude(id=data.asset.id) for rotator in (data.rotator, other_rotator))
+
+        more_num_queries, exported = num_export_queries()
+        self.assertEqual(num_queries, more_num_queries)
+
+        # Same output as Django's serializer, including ordering of many-to-many pks
+        expected = [obj['fields']['rotators'] for obj in json.loads(serialize('json', Asset.objects.all()))]
+        self.assertEqual([obj['fields']['rotators'] for obj in exported['objects'] if obj['model'] == 'tomato.asset'],
+                         expected)
+        self.assertIn([other_rotator.id, data.rotator.id], expected)
+
+    def test_export_snapshot(self):
+        self.client.login(username='user', password='user')
+        data = self.create_basic_data()
+
+        def get_gzipped_export():
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(reverse('export'), HTTP_ACCEPT_ENCODING='gzip')
+                self.assertEqual(response['Content-Encoding'], 'gzip')
+                exported = json.loads(gzip.decompress(b''.join(response)))
+            catalog_queried = any('"assets"' in query['sql'] for query in context.captured_queries)
+            return exported, catalog_queried
+
+        exported, catalog_queried = get_gzipped_export()
+        self.assertTrue(catalog_queried)
+        self.assertEqual(get_gzipped_export(), (exported, False))
+
+        data.asset.name = 'renamed'
+        # TestCase never commits, so run what's deferred until then
+        with self.captureOnCommitCallbacks(execute=True):
+            data.asset.save()
+
+        exported, catalog_queried = get_gzipped_export()
+        self.assertTrue(catalog_queried)
+        self.assertEqual(exported['objects'][0]['fields']['name'], 'renamed')
+
+        # A caller that finds the snapshot being built waits and serves it, rather than serializing too
+        snapshot_data = {'version': 1, 'format': 'test'}
+        data_hash = hashlib.md5(json_dumps(snapshot_data).encode('utf8')).hexdigest()
+        iter_chunks = mock.Mock()
+        with open(os.path.join(settings.EXPORT_SNAPSHOT_LOCK_ROOT, f'{data_hash}.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            def finish_building(seconds):
+                caches['export'].set(f'export:1:{data_hash}', b'built elsewhere')
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+            with mock.patch('tomato.export.time.sleep', side_effect=finish_building):
+                self.assertEqual(get_export_snapshot(snapshot_data, iter_chunks), b'built elsewhere')
+
+            # Only if that takes too long is the export streamed instead
+            caches['export'].clear()
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            with mock.patch('tomato.export.EXPORT_SNAPSHOT_WAIT_TIMEOUT', 0):
+                self.assertIsNone(get_export_snapshot(snapshot_data, iter_chunks))
+        iter_chunks.assert_not_called()
+
+        # Snapshots are cleared once per transaction, however many changes it made
+        with mock.patch('tomato.signals.clear_export_snapshots') as clear_export_snapshots:
+            with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+                data.asset.save()
+                data.rotator.save()
+        clear_export_snapshots.assert_called_once_with()
+
+    def test_export_columnar(self):
+        self.client.login(username='user', password='user')
+        data = self.create_basic_data()
+        Asset.objects.filter(id=data.asset.id).update(
+            begin='2020-01-01T12:34:56.789Z', weight='2.75', duration=datetime.timedelta(seconds=12.3456))
+        Rotator.objects.create(name='empty', color='teal')
+
+        exported = self.get_export(format='columnar')
+        self.assertEqual(exported['format'], 'columnar')
+        self.assertEqual(exported['tables']['tomato.asset']['blocks'][0]['weight'], [275])
+        self.assertEqual(exported['tables']['tomato.asset']['blocks'][0]['duration'], [12346])
+
+        # Sent as an index into a lookup table
+        rotators = exported['tables']['tomato.rotator']
+        self.assertEqual([rotators['lookups']['color'][index] for index in rotators['blocks'][0]['color']],
+                         ['teal', 'red'])  # Ordered by name
+
+        decoded = {(type(obj.object), obj.object.pk): obj for obj in decode_tables(exported['tables'])}
+        self.assertEqual(len(decoded), 5)
+        asset = decoded[Asset, data.asset.id]
+        self.assertEqual(asset.m2m_data, {'rotators': [data.rotator.id]})
+        for field in ('name', 'enabled', 'begin', 'end', 'weight', 'audio', 'audio_size', 'version'):
+            self.assertEqual(getattr(asset.object, field), getattr(Asset.objects.get(), field))
+        self.assertEqual(asset.object.duration, datetime.timedelta(seconds=12.346))
+        self.assertEqual(decoded[StopSetRotator, data.stopset.stopsetrotator_set.get().id].object.stopset_id,
+                         data.stopset.id)
+
+        # A block of columns is sent per chunk of rows
+        tables = json.loads(''.join(iter_columnar_json({'format': 'columnar'}, [Rotator.objects.all()],
+                                                       chunk_size=1)))['tables']
+        self.assertEqual(len(tables['tomato.rotator']['blocks']), 2)
+        self.assertEqual([obj.object.name for obj in decode_tables(tables)],
+                         list(Rotator.objects.values_list('name', flat=True)))
+
+        response = self.client.get(reverse('export'), HTTP_ACCEPT='application/vnd.tomato.columnar+json')
+        self.assertEqual(response['Content-Type'], 'application/vnd.tomato.columnar+json')
+
+    def test_log_view(self):
+        response = self.client.post(reverse('log'), data='[]', content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+        self.client.login(username='user', password='user')
+        existing = LogEntry.objects.create(action='played_asset', description='existing')
+        uuids = [str(uuid.uuid4()) for _ in range(3)]
+        log_entries = [{'model': 'tomato.logentry', 'fields': {
+            'uuid': log_uuid, 'created': '2020-03-14T15:09:26.535Z', 'action': 'played_asset',
+            'duration': '00:00:30', 'description': f'entry #{num}'}} for num, log_uuid in enumerate(uuids)]
+        log_entries.extend([
+            # Already pushed, so ignored
+            {'model': 'tomato.logentry', 'fields': {'uuid': str(existing.uuid), 'description': 'changed'}},
+            # Not a log entry
+            {'model': 'auth.user', 'fields': {'username': 'sneaky'}},
+        ])
+
+        body = gzip.compress(json.dumps(log_entries).encode('utf8'))
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('log'), data=body, content_type='application/json',
+                                        HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        # One query for existing UUIDs, one insert
+        log_queries = [query['sql'] for query in context.captured_queries if '"log_entries"' in query['sql']]
+        self.assertEqual(len(log_queries), 2)
+
+        self.assertEqual(LogEntry.objects.count(), 4)
+        self.assertEqual(LogEntry.objects.get(uuid=existing.uuid).description, 'existing')
+        log_entry = LogEntry.objects.get(uuid=uuids[1])
+        self.assertEqual((log_entry.user_id, log_entry.duration, log_entry.description),
+                         (self.user.id, datetime.timedelta(seconds=30), 'entry #1'))
+        self.assertFalse(User.objects.filter(username='sneaky').exists())
+
+        # Pushing the same entries again is a no-op
+        response = self.client.post(reverse('log'), data=body, content_type='application/json',
+                                    HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(LogEntry.objects.count(), 4)
+
+        response = self.client.post(reverse('log'), data='not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        # Entries without a UUID can't be deduped, so they're rejected
+        response = self.client.post(reverse('log'), data=json.dumps([{'model': 'tomato.logentry', 'fields': {
+            'action': 'played_asset', 'description': 'no uuid'}}]), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(LogEntry.objects.count(), 4)
+
+        # Bodies can't decompress to more than Django would accept uncompressed
+        with self.settings(DATA_UPLOAD_MAX_MEMORY_SIZE=len(body)):
+            response = self.client.post(reverse('log'), data=gzip.compress(b' ' * (len(body) + 1)),
+                                        content_type='application/json', HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 413)
+
+    def test_log_rollups(self):
+        self.client.login(username='user', password='user')
+
+        def push(*entries):
+            body = json.dumps([{'model': 'tomato.logentry', 'fields': {
+                'uuid': str(uuid.uuid4()), 'created': created, 'action': action, 'duration': duration,
+                'description': description}} for created, action, duration, description in entries])
+            response = self.client.post(reverse('log'), data=body, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+
+        # Days are in the station's timezone, US/Pacific
+        push(('2020-03-14T15:00:00Z', 'played_asset', '00:00:30', 'ad'),
+             ('2020-03-15T06:00:00Z', 'played_asset', '00:00:15', 'ad'),
+             ('2020-03-14T16:00:00Z', 'skipped_asset', None, 'ad'))
+        push(('2020-03-14T17:00:00Z', 'played_asset', '00:01:00', 'ad'),
+             ('2020-04-01T17:00:00Z', 'played_asset', '00:01:00', 'promo'))
+
+        rollup = LogEntryRollup.objects.get(day=datetime.date(2020, 3, 14), action='played_asset')
+        self.assertEqual((rollup.user_id, rollup.count, rollup.duration),
+                         (self.user.id, 3, datetime.timedelta(seconds=105)))
+        self.assertEqual(LogEntryRollup.objects.get(action='skipped_asset').count, 1)
+        self.assertEqual(LogEntryRollup.objects.count(), 3)
+
+        # Entries created by the admin are rolled up too
+        self.client.login(username='super', password='super')
+        self.client.post(reverse('admin:tomato_rotator_add'), {'name': 'new rotator', 'color': 'red'})
+        self.assertTrue(LogEntryRollup.objects.filter(action='added_rotator', user_id=self.super.id).exists())
+
+        response = self.client.get(reverse('admin:tomato_logentryrollup_changelist'), {'action__exact': 'played_asset'})
+        self.assertEqual(response.context_data['totals'], {'count': 4, 'duration': '2:45'})
+
+        response = self.client.get(reverse('admin:tomato_logentryrollup_export'), {'actions': 'played_asset'})
+        rows = b''.join(response.streaming_content).decode('utf8').splitlines()
+        self.assertEqual(rows, ['Month,Action,User,Description (if any),Count,Total Duration',
+                                '2020-04,played_asset,user,promo,1,0:01:00',
+                                '2020-03,played_asset,user,ad,3,0:01:45'])
+
+        # Entries without a user are totalled together too, and kept unique despite the null user_id
+        created = datetime.datetime(2020, 3, 14, 20, tzinfo=datetime.timezone.utc)
+        for _ in range(2):
+            LogEntryRollup.add_log_entries([LogEntry(action='waited', created=created)])
+        rollup = LogEntryRollup.objects.get(action='waited')
+        self.assertEqual((rollup.user_id, rollup.count), (None, 2))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            LogEntryRollup.objects.create(day=rollup.day, action='waited')
+
+    def test_log_archive(self):
+        self.client.login(username='super', password='super')
+        now = timezone.now()
+        for days_ago, action in ((2, 'played_asset'), (400, 'played_asset'), (440, 'waited'), (800, 'played_asset')):
+            LogEntry.objects.create(user_id=self.user.id, action=action, description=f'{days_ago} days ago',
+                                    duration=datetime.timedelta(seconds=days_ago),
+                                    created=now - datetime.timedelta(days=days_ago))
+
+        def export(**params):
+            response = self.client.get(reverse('admin:tomato_logentry_export'), data={'begin': '', **params})
+            rows = list(csv.reader(b''.join(response.streaming_content).decode('utf8').splitlines()))[1:]
+            return [row[-1] for row in rows]
+
+        before = export()
+        archive_root = os.path.join(settings.MEDIA_ROOT, 'archive')
+        with self.settings(LOG_ARCHIVE_ROOT=archive_root, LOG_ENTRY_RETENTION=datetime.timedelta(days=365)):
+            call_command('archive_log_entries', stdout=io.StringIO())
+            self.assertEqual(list(LogEntry.objects.values_list('description', flat=True)), ['2 days ago'])
+            self.assertEqual(len(os.listdir(archive_root)), 3)
+
+            # Archived entries are still exported, in the same order and with the same values
+            self.assertEqual(export(), before)
+            self.assertEqual(export(actions='waited'), ['440 days ago'])
+            begin = timezone.localdate(now - datetime.timedelta(days=405))
+            self.assertEqual(export(begin=begin.isoformat()), ['2 days ago', '400 days ago'])
+
+            # Entries pushed late for an archived month are added to its file without duplicating it
+            LogEntry.objects.create(action='played_asset', description='late',
+                                    created=now - datetime.timedelta(days=800, hours=1))
+            call_command('archive_log_entries', stdout=io.StringIO())
+            self.assertEqual(LogEntry.objects.count(), 1)
+            self.assertEqual(export(), before + ['late'])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Checks PostgreSQL query plans')
+    def test_query_plans(self):
+        now = timezone.now()
+        # Mostly disabled or expired, like a station's years of old spots
+        Asset.objects.bulk_create(Asset(
+            name=f'asset {num}', audio=f'{num}.wav', duration=datetime.timedelta(0), audio_size=0,
+            enabled=num % 10 == 0, end=now - datetime.timedelta(days=1) if num % 3 else None,
+        ) for num in range(100))
+        StopSet.objects.bulk_create(StopSet(name=f'stopset {num}', enabled=num % 10 == 0) for num in range(100))
+        actions = ('played_asset', 'played_stopset', 'skipped_asset', 'waited')
+        LogEntry.objects.bulk_create(LogEntry(
+            action=actions[num % len(actions)], created=now - datetime.timedelta(minutes=num),
+        ) for num in range(100))
+
+        # Too few rows to be worth an index otherwise, so make sequential scans a last resort
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE assets, stopsets, log_entries')
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+        self.assertIn('assets_enabled_airing', Asset.objects.currently_enabled(now).order_by().explain())
+        self.assertIn('stopsets_enabled_airing', StopSet.objects.currently_enabled(now).order_by().explain())
+
+        # Read in index order, rather than sorted
+        for queryset, index in ((LogEntry.objects.all(), 'log_entries_created'),
+                                (LogEntry.objects.filter(action='skipped_asset'), 'log_entries_action_created')):
+            plan = queryset[:25].explain()
+            self.assertRegex(plan, rf'Index (Only )?Scan using {index}\b')
+            self.assertNotIn('Sort', plan)
+
+    def test_auth_token_cache(self):
+        token = self.client.post(reverse('auth'), data={'username': 'user', 'password': 'user'}).json()['auth_token']
+
+        def ping():
+            with CaptureQueriesContext(connection) as context:
+                valid_token = self.client.get(reverse('ping'), HTTP_X_AUTH_TOKEN=token).json()['valid_token']
+            return valid_token, any('"auth_user"' in query['sql'] for query in context.captured_queries)
+
+        self.assertEqual(ping(), (True, True))
+        self.assertEqual(ping(), (True, False))
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(ping(), (False, True))
+
+        self.user.is_active = True
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertEqual(ping(), (False, True))
+
+        # Revoked by another worker, with its own connection to the shared cache
+        token = self.client.post(reverse('auth'), data={'username': 'user', 'password': 'changed'}).json()['auth_token']
+        self.assertEqual(ping(), (True, True))
+        self.assertEqual(ping(), (True, False))
+
+        # The other worker's save, with the row written here since the test holds the database transaction
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        other_auth_caches = []
+
+        def save_user_elsewhere():
+            other_auth_caches.append(caches['auth'])
+            post_save.send(User, instance=self.user, created=False)
+
+        thread = threading.Thread(target=save_user_elsewhere)
+        thread.start()
+        thread.join()
+        self.assertIsNot(other_auth_caches[0], caches['auth'])
+        self.assertEqual(ping(), (False, True))
+
+    def test_config_cache(self):
+        def ping_config_queries():
+            with CaptureQueriesContext(connection) as context:
+                self.client.get(reverse('ping'))
+            return [query['sql'] for query in context.captured_queries if '"constance_config"' in query['sql']]
+
+        self.assertEqual(len(ping_config_queries()), 1)
+        self.assertEqual(ping_config_queries(), [])
+
+        config.TIMEZONE = 'US/Eastern'
+        self.addCleanup(timezone.deactivate)
+        self.assertEqual(len(ping_config_queries()), 1)
+        self.assertEqual(timezone.get_current_timezone_name(), 'US/Eastern')
+
+    def test_ping_view(self):
+        self.client.get(reverse('ping'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('ping')).json()
+
+        self.assertEqual(response['latest_migration'], get_latest_tomato_migration())
+        self.assertIsNotNone(response['latest_migration'])
+        self.assertFalse(response['valid_token'])
@@ -1,40 +1,95 @@
+from collections import defaultdict
+import gzip
 import hashlib
-import itertools
+import io
+import json
 from urllib.parse import urlparse
 
 
+from django.apps import apps
 from django.conf import settings
 from django.core import signing
-from django.core.serializers import deserialize, serialize
+from django.core.exceptions import RequestDataTooBig, ValidationError
 from django.contrib.auth import authenticate, login
-from django.http import HttpResponse, HttpResponseForbidden, HttpResponseRedirect, JsonResponse
+from django.db import transaction
+from django.http import (HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseRedirect,
+                         JsonResponse, StreamingHttpResponse)
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.gzip import gzip_page
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import condition
 from django.urls import reverse
 
-from constance import config
-
-from .client_server_constants import CLIENT_CONFIG_KEYS
-from .models import get_latest_tomato_migration, Asset, LogEntry, Rotator, StopSet, StopSetRotator
+from .cache import get_cached_catalog_version, get_client_config
+from .columnar import COLUMNAR_CONTENT_TYPE, COLUMNAR_FORMAT
+from .export import get_export_snapshot, iter_columnar_json, iter_export_json
+from .models import (get_catalog_version, Asset, LogEntry, LogEntryRollup, Rotator, StopSet, StopSetRotator,
+                     Tombstone)
 from .version import __version__
 
 
 def ping(request):
     return JsonResponse({
-        'latest_migration': get_latest_tomato_migration(),
+        'catalog_version': get_cached_catalog_version(),
+        'latest_migration': apps.get_app_config('tomato').latest_migration,
         'valid_token': request.valid_token,
         'version': __version__,
     })
 
 
+LOG_ENTRY_BATCH_SIZE = 500
+LOG_ENTRY_FIELDS = ('uuid', 'created', 'action', 'duration', 'description')
+
+
+def decompress_body(body):
+    # Bound what the body decompresses to the same as Django bounds the body itself, so a small
+    # request can't expand into something huge
+    max_size = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+    with gzip.GzipFile(fileobj=io.BytesIO(body)) as file:
+        body = file.read(-1 if max_size is None else max_size + 1)
+    if max_size is not None and len(body) > max_size:
+        raise RequestDataTooBig('Decompressed request body exceeded settings.DATA_UPLOAD_MAX_MEMORY_SIZE.')
+    return body
+
+
+def parse_log_entries(objs, user_id):
+    log_entries = {}
+    for obj in objs:
+        # Make sure we're only ingesting log entries
+        if obj.get('model') == LogEntry._meta.label_lower:
+            # Entries are deduped by UUID, so one without would get a new one on every retry
+            if not obj['fields'].get('uuid'):
+                raise ValidationError('Log entries require a uuid.')
+            log_entry = LogEntry(user_id=user_id, **{
+                name: LogEntry._meta.get_field(name).to_python(value)
+                for name, value in obj['fields'].items() if name in LOG_ENTRY_FIELDS})
+            # Last one wins for dupes within a batch
+            log_entries[log_entry.uuid] = log_entry
+    return list(log_entries.values())
+
+
 @csrf_exempt
 def log(request):
     if request.user.is_authenticated and request.method == 'POST':
-        for log_entry in deserialize('json', request.body):
-            # Make sure we're only serializing log entries
-            if isinstance(log_entry.object, LogEntry):
-                log_entry.object.user_id = request.user.id
-                log_entry.save()
+        try:
+            body = request.body
+            if request.headers.get('Content-Encoding') == 'gzip':
+                body = decompress_body(body)
+            log_entries = parse_log_entries(json.loads(body), user_id=request.user.id)
+        except RequestDataTooBig:
+            return HttpResponse(status=413)
+        except (OSError, EOFError, ValueError, KeyError, TypeError, AttributeError, ValidationError):
+            return HttpResponseBadRequest()
+
+        # Entries are idempotent by UUID, so retried pushes from clients are no-ops
+        with transaction.atomic():
+            for offset in range(0, len(log_entries), LOG_ENTRY_BATCH_SIZE):
+                batch = log_entries[offset:offset + LOG_ENTRY_BATCH_SIZE]
+                existing_uuids = set(LogEntry.objects.filter(
+                    uuid__in=[log_entry.uuid for log_entry in batch]).values_list('uuid', flat=True))
+                new_log_entries = [log_entry for log_entry in batch if log_entry.uuid not in existing_uuids]
+                LogEntry.objects.bulk_create(new_log_entries, ignore_conflicts=True)
+                LogEntryRollup.add_log_entries(new_log_entries)
 
         return HttpResponse()
     else:
@@ -63,7 +118,15 @@ def token_login(request):
     return response
 
 
+def export_etag(request):
+    # Any change to the catalog or client config bumps the catalog version, so it's a
+    # sufficient ETag for both full and delta exports
+    if request.user.is_authenticated:
+        return str(get_catalog_version())
+
+
 @gzip_page
+@condition(etag_func=export_etag)
 def export(request):
     response = HttpResponseForbidden()
 
@@ -75,11 +138,47 @@ def export(request):
         if not media_url.scheme:
             media_url = media_url._replace(scheme=request.scheme)
 
-        response = JsonResponse({
-            'conf': {key: getattr(config, key.upper()) for key in CLIENT_CONFIG_KEYS},
+        # Read the version *before* the objects, so anything written in the meantime gets
+        # re-sent on the next sync rather than skipped
+        version = get_catalog_version()
+        since = request.GET.get('since')
+        delta = since is not None and since.isdigit() and int(since) <= version
+
+        querysets = [cls.objects.all() for cls in (Asset, Rotator, StopSet, StopSetRotator)]
+        data = {
+            'conf': get_client_config(version),
+            'delta': delta,
             'media_url': media_url.geturl(),
-            'objects': serialize('python', itertools.chain.from_iterable(
-                cls.objects.all() for cls in (Asset, Rotator, StopSet, StopSetRotator))),
-        })
+            'version': version,
+        }
+
+        if delta:
+            since = int(since)
+            querysets = [queryset.filter(version__gt=since) for queryset in querysets]
+            deleted = defaultdict(list)
+            for model, object_id in Tombstone.objects.filter(version__gt=since).values_list('model', 'object_id'):
+                deleted[model].append(object_id)
+            data['deleted'] = deleted
+
+        if (request.GET.get('format') == COLUMNAR_FORMAT
+                or COLUMNAR_CONTENT_TYPE in request.headers.get('Accept', '')):
+            data['format'] = COLUMNAR_FORMAT
+            content_type = COLUMNAR_CONTENT_TYPE
+            iter_chunks = iter_columnar_json
+        else:
+            content_type = 'application/json'
+            iter_chunks = iter_export_json
+
+        # Full exports are identical for every client, so serve them from a shared snapshot
+        snapshot = None
+        if not delta and 'gzip' in request.headers.get('Accept-Encoding', ''):
+            snapshot = get_export_snapshot(data, lambda: iter_chunks(data, querysets))
+
+        if snapshot is None:
+            response = StreamingHttpResponse(iter_chunks(data, querysets), content_type=content_type)
+        else:
+            response = HttpResponse(snapshot, content_type=content_type)
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
 
     return response